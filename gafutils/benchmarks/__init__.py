@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmarks for gafutils hot paths.
+
+The :mod:`~gafutils.benchmarks.scenarios` are run by the ``gafutils_benchmark`` command, from the test project::
+
+    python manage.py gafutils_benchmark --output baseline.json
+    python manage.py gafutils_benchmark --baseline baseline.json --threshold 0.2
+
+They run on a test database, created and destroyed without confirmation : backends other than
+SQLite need the ``--allow-non-sqlite`` option.
+"""
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Compares registry reads with plain dict reads.
+
+Run it with ``python -m gafutils.benchmarks.registry``.
+"""
+from timeit import Timer
+
+
+def make_registry(size=100):
+    """Returns a discovered :class:`DictRegistry` holding `size` elements, and its keys"""
+    from gafutils.registry import DictRegistry
+    
+    class BenchRegistry(DictRegistry):
+        autoload = False
+    
+    registry = BenchRegistry()
+    keys = ['key%d' % i for i in range(size)]
+    for key in keys:
+        registry.register(object(), key)
+    registry._discover_status = registry.DISCOVERING
+    registry._bind_accessors()
+    registry._discover_status = registry.DISCOVERED
+    return registry, keys
+
+def run(number=200):
+    """Returns a list of ``(name, seconds)`` timings"""
+    registry, keys = make_registry()
+    plain = dict(registry._registry)
+    cases = [
+        ('dict[key]', lambda: [plain[k] for k in keys]),
+        ('registry[key]', lambda: [registry[k] for k in keys]),
+        ('dict.get(key)', lambda: [plain.get(k) for k in keys]),
+        ('registry.get(key)', lambda: [registry.get(k) for k in keys]),
+        ('dict.values()', lambda: plain.values()),
+        ('registry.values()', lambda: registry.values()),
+    ]
+    return [(name, min(Timer(func).repeat(5, number))) for name, func in cases]
+
+if __name__ == '__main__':
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure()
+    for name, seconds in run():
+        print "%-20s %8.2f us" % (name, seconds * 1e6 / 200)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Benchmark scenarios built on the models and registries of gafutils' test app.
+
+They need ``gafutils_testapp`` in ``INSTALLED_APPS`` and its tables, see the ``gafutils_benchmark`` command.
+"""
+from gafutils.instrumentation import collect, get_sink, measure, set_sink
+import time
+
+class Scenario(object):
+    """Base class of benchmark scenarios.
+
+    :meth:`run` is timed `number` times in a row, and the best of `repeat` such loops is kept.
+    Loops are timed without any stats sink nor collector, queries being counted in another run.
+    """
+    name = None
+    number = 10
+
+    def setup(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+    def teardown(self):
+        pass
+
+    def measure(self, repeat=5):
+        """Returns the best time and the query count of a single :meth:`run`, as a dict."""
+        self.setup()
+        try:
+            sink = get_sink()
+            set_sink(None)
+            try:
+                best = None
+                for i in range(repeat):
+                    start = time.time()
+                    for j in range(self.number):
+                        self.run()
+                    duration = (time.time() - start) / self.number
+                    best = duration if best is None else min(best, duration)
+            finally:
+                set_sink(sink)
+            with collect() as stats:
+                with measure('benchmark'):
+                    self.run()
+            return {
+                'time': best,
+                'queries': stats.queries('benchmark'),
+            }
+        finally:
+            self.teardown()
+
+class DefaultObjectSwitch(Scenario):
+    """Switches the default object between `size` pictures, with multi-table inheritance."""
+    name = 'default_object.switch'
+    size = 10
+
+    def setup(self):
+        from gafutils.tests.project.gafutils_testapp.models import Picture, TinyPicture
+        self.pictures = [Picture.objects.create(name='pic%d' % i) for i in range(self.size)]
+        self.pictures += [TinyPicture.objects.create(name='tiny%d' % i) for i in range(self.size)]
+        self.index = 0
+
+    def run(self):
+        self.index = (self.index + 1) % len(self.pictures)
+        picture = self.pictures[self.index]
+        picture.is_default = True
+        picture.save()
+
+    def teardown(self):
+        from gafutils.tests.project.gafutils_testapp.models import Picture, SmallPicture
+        # default objects can't be deleted
+        Picture.objects.all().update(is_default=False)
+        SmallPicture.objects.all().update(is_small_default=False)
+        Picture.objects.all().delete()
+
+class DynamicTypeAccess(Scenario):
+    """Sets and gets `ValueHolder` values of every type through the field descriptor."""
+    name = 'dynamic_type.access'
+    number = 100
+
+    def setup(self):
+        from gafutils.tests.project.gafutils_testapp.models import TypedValueHolder
+        self.holders = []
+        for value_type, value in (('bool', True), ('str', u'text'), ('int', 42), ('float', 4.2)):
+            holder = TypedValueHolder(value_type=value_type)
+            self.holders.append((holder, value))
+
+    def run(self):
+        for holder, value in self.holders:
+            holder.value = value
+            holder.value
+
+class PolymorphicIteration(Scenario):
+    """Iterates over `rows` polymorphic objects of `types` types."""
+    name = 'polymorphism.iter'
+    number = 3
+    rows = 300
+    types = 3
+
+    def setup(self):
+        from gafutils.tests.project.gafutils_testapp.models import Dog, Cat, Bird
+        models = (Dog, Cat, Bird)[:self.types]
+        for i in range(self.rows):
+            models[i % len(models)].objects.create(name='animal%d' % i)
+
+    def run(self):
+        from gafutils.tests.project.gafutils_testapp.models import Animal
+        for animal in Animal.objects.select_polymorphic():
+            pass
+
+    def teardown(self):
+        from gafutils.tests.project.gafutils_testapp.models import Dog, Cat, Bird
+        for model in (Dog, Cat, Bird):
+            model.objects.all().delete()
+
+class RegistryLookup(Scenario):
+    """Reads every element of a discovered registry."""
+    name = 'registry.lookup'
+    number = 100
+
+    def setup(self):
+        from gafutils.benchmarks.registry import make_registry
+        self.registry, self.keys = make_registry()
+
+    def run(self):
+        registry = self.registry
+        for key in self.keys:
+            registry[key]
+            registry.get(key)
+
+class RegistryDiscovery(Scenario):
+    """Discovers a new registry instance over all installed apps."""
+    name = 'registry.discovery'
+
+    def setup(self):
+        from gafutils.tests.project.gafutils_testapp.registries import handlers
+        # the first discovery imports the registered modules, that register in `handlers`
+        len(handlers)
+
+    def run(self):
+        from gafutils.tests.project.gafutils_testapp.registries import HandlerRegistry
+        len(HandlerRegistry())
+
+SCENARIOS = (
+    DefaultObjectSwitch,
+    DynamicTypeAccess,
+    PolymorphicIteration,
+    RegistryLookup,
+    RegistryDiscovery,
+)
+
+def run(names=None, repeat=5):
+    """Runs the scenarios named `names` (default: all), and returns a dict of results by scenario name."""
+    results = {}
+    for scenario_class in SCENARIOS:
+        if names and scenario_class.name not in names:
+            continue
+        results[scenario_class.name] = scenario_class().measure(repeat)
+    return results
+
+def compare(results, baseline, threshold=0.2):
+    """Compares `results` with `baseline` results.
+
+    Returns a list of ``(name, result, baseline_result, regressed)`` tuples, a scenario regressing
+    when it is more than `threshold` (a ratio) slower or makes more queries.
+    """
+    comparison = []
+    for name in sorted(results):
+        result = results[name]
+        base = baseline.get(name)
+        regressed = base is not None and (
+            result['time'] > base['time'] * (1 + threshold) or result['queries'] > base['queries'])
+        comparison.append((name, result, base, regressed))
+    return comparison
@@ -7,17 +7,48 @@ Created on 24 mars 2013
 @author: gabriel
 '''
 from django.core.management.base import BaseCommand
+from django.db import connections, transaction, DatabaseError
+from django.utils.encoding import force_unicode
 from optparse import make_option
 import os
 from django.core.management.base import CommandError
-from subprocess import check_call
+from gafutils.registry import _max_rss
+from subprocess import check_call, Popen, PIPE, STDOUT
+from contextlib import contextmanager
+import json
+import multiprocessing
+import Queue
 import shlex
+import tempfile
+import threading
 import logging
+import time
+import traceback
+
+class Step(object):
+    """A shell command run by :meth:`SudoCommand.run_steps`"""
+    
+    def __init__(self, command, requires=(), timeout=None):
+        """
+        :param command: a command line (split with :func:`shlex.split`) or a list of arguments
+        :param requires: names of the steps that must succeed before this one is started
+        :param timeout: seconds after which the step is killed
+        """
+        self.command = command
+        self.requires = tuple(requires)
+        self.timeout = timeout
+    
+    def get_args(self):
+        if isinstance(self.command, basestring):
+            return shlex.split(self.command)
+        return list(self.command)
 
 class SudoCommand(BaseCommand):
     """
     Base command supposed to be run as root user.
     Root user checking may be disabled by `--non-root` option.
+    
+    System steps can be run concurrently with :meth:`run_steps`.
     """
     
     option_list = BaseCommand.option_list + (
@@ -26,32 +57,413 @@ class SudoCommand(BaseCommand):
             default=False,
             help=u"Skip user-is-root check"
         ),
+        make_option("--dry-run",
+            action="store_true",
+            default=False,
+            help=u"Print the steps plan instead of running it"
+        ),
+        make_option("--jobs",
+            type="int",
+            default=4,
+            help=u"Maximum number of steps running concurrently"
+        ),
     )
     
+    logger = logging.getLogger('gafutils.commands')
+    
     def handle(self, *args, **options):
         
         if not os.getuid() is 0 and not options['non_root']:
             raise CommandError(u"This command must be run as root")
         
+        self.options = options
         self.sudo_handle(*args, **options)
+    
+    def run_steps(self, steps, jobs=None, timeout=None, dry_run=None):
+        """Runs a graph of shell commands, starting each step as soon as its requirements succeeded.
+        
+        Steps output is logged line by line, prefixed with the step name.
+        If a step fails or times out, the steps depending on it are skipped and
+        a :exc:`CommandError` is raised once the running steps are finished.
+        
+        :param dict steps: a ``{<name>: <Step or command>}`` mapping
+        :param int jobs: maximum number of concurrent steps (default: ``--jobs``)
+        :param timeout: default steps timeout, in seconds
+        :param dry_run: only print the plan (default: ``--dry-run``)
+        """
+        options = getattr(self, 'options', {})
+        jobs = jobs or options.get('jobs') or 1
+        if dry_run is None:
+            dry_run = options.get('dry_run', False)
+        steps = dict((name, step if isinstance(step, Step) else Step(step))
+                     for name, step in steps.iteritems())
+        stages = self.get_stages(steps)
         
+        if dry_run:
+            for i, stage in enumerate(stages):
+                for name in stage:
+                    step = steps[name]
+                    requires = (u" (after %s)" % u", ".join(step.requires)) if step.requires else u""
+                    self.stdout.write(u"%d. %s: %s%s\n" % (i + 1, name, u" ".join(step.get_args()), requires))
+            return
+        
+        remaining = dict(steps)
+        done, failed, skipped, running = set(), set(), set(), {}
+        results = Queue.Queue()
+        while remaining or running:
+            for name in sorted(remaining):
+                step = remaining[name]
+                if any(r in failed or r in skipped for r in step.requires):
+                    self.logger.warning(u"[%s] skipped", name)
+                    skipped.add(name)
+                    del remaining[name]
+                elif len(running) < jobs and all(r in done for r in step.requires):
+                    del remaining[name]
+                    thread = threading.Thread(target=self._run_step,
+                                              args=(name, step, step.timeout or timeout, results))
+                    thread.start()
+                    running[name] = thread
+            if not running:
+                # Remaining steps depend on steps skipped during this pass
+                continue
+            name, ok = results.get()
+            running.pop(name).join()
+            (done if ok else failed).add(name)
+        
+        if failed or skipped:
+            raise CommandError(u"Failed steps: %s. Skipped steps: %s." % (
+                u", ".join(sorted(failed)) or u"none", u", ".join(sorted(skipped)) or u"none"))
+    
+    def get_stages(self, steps):
+        """Returns the list of step names lists that can run concurrently, in execution order.
+        
+        Raises :exc:`CommandError` on unknown requirements or cycles.
+        """
+        for name, step in steps.iteritems():
+            for required in step.requires:
+                if required not in steps:
+                    raise CommandError(u"Step %s requires unknown step %s" % (name, required))
+        stages, placed = [], set()
+        while len(placed) < len(steps):
+            stage = sorted(name for name, step in steps.iteritems()
+                           if name not in placed and all(r in placed for r in step.requires))
+            if not stage:
+                raise CommandError(u"Steps have circular requirements: %s" % u", ".join(sorted(set(steps) - placed)))
+            stages.append(stage)
+            placed.update(stage)
+        return stages
+    
+    def _run_step(self, name, step, timeout, results):
+        ok = False
+        try:
+            args = step.get_args()
+            # Arguments and output are byte strings, whatever their encoding
+            self.logger.info(u"[%s] %s", name, u" ".join(force_unicode(arg, errors='replace') for arg in args))
+            proc = Popen(args, stdout=PIPE, stderr=STDOUT, close_fds=True)
+            timed_out = []
+            timer = None
+            if timeout:
+                def kill():
+                    timed_out.append(True)
+                    proc.kill()
+                timer = threading.Timer(timeout, kill)
+                timer.start()
+            for line in iter(proc.stdout.readline, ''):
+                self.logger.info(u"[%s] %s", name, force_unicode(line.rstrip('\n'), errors='replace'))
+            returncode = proc.wait()
+            if timer is not None:
+                timer.cancel()
+            if timed_out:
+                self.logger.error(u"[%s] timed out after %ss", name, timeout)
+            elif returncode:
+                self.logger.error(u"[%s] exited with code %d", name, returncode)
+            else:
+                ok = True
+        except Exception:
+            self.logger.exception(u"[%s] failed", name)
+        finally:
+            results.put((name, ok))
+        
+class SamplingFilter(logging.Filter):
+    """Lets through one of every `every` records of `level` or lower. Upper level records always pass."""
+    
+    def __init__(self, every, level=logging.DEBUG):
+        logging.Filter.__init__(self)
+        self.every = every
+        self.level = level
+        self.count = 0
+    
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+        self.count += 1
+        return (self.count - 1) % self.every == 0
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `rate` records of `level` or lower per second. Upper level records always pass."""
+    
+    def __init__(self, rate, level=logging.DEBUG):
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.level = level
+        self.second = None
+        self.count = 0
+    
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+        second = int(record.created)
+        if second != self.second:
+            self.second, self.count = second, 0
+        self.count += 1
+        return self.count <= self.rate
+
+class QueueHandler(logging.Handler):
+    """Puts the records in a queue, for a :class:`QueueListener` (python 2 backport of the python 3 one)"""
+    
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+    
+    def prepare(self, record):
+        # The message and traceback are formatted now, arguments may change before the record is handled
+        record.msg = record.message = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+    
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+class QueueListener(object):
+    """Thread passing the records of a queue to `handlers`, that respect their level"""
+    
+    _sentinel = None
+    
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor)
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+    
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is self._sentinel:
+                break
+            self.handle(record)
+    
+    def stop(self):
+        """Handles the queued records, then stops the thread"""
+        self.queue.put_nowait(self._sentinel)
+        self._thread.join()
+        self._thread = None
+
+def _cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
 class ExtendedBaseCommand(BaseCommand):
     """
     Extended command class
+    
+    Provides profiling options :
+    
+     * ``--profile``: runs :meth:`do_handle` under cProfile and prints the top functions
+       (``--profile-file`` dumps the stats, ``--profile-top`` sets the number of printed lines)
+     * ``--timing``: prints the wall and CPU time of each phase (see :meth:`phase`)
+     * ``--mem``: prints the peak memory and, with tracemalloc, the top allocation sites
+       (without tracemalloc, the peak resident set size of the process is printed)
+    
+    Reports are written to stderr.
+    
+    Long queryset iterations can be checkpointed with :meth:`iter_checkpointed` and
+    resumed with ``--resume``.
+    
+    With ``--async-log`` (or :attr:`async_logging`), the root and command loggers handlers
+    are run by a background thread, fed through a queue. ``--log-sample`` and ``--log-rate``
+    limit the number of debug messages of the command logger.
     """
     
+    option_list = BaseCommand.option_list + (
+        make_option("--profile",
+            action="store_true",
+            default=False,
+            help=u"Profile the command with cProfile"
+        ),
+        make_option("--profile-file",
+            default=None,
+            help=u"Dump the profile stats to this file (implies --profile)"
+        ),
+        make_option("--profile-top",
+            type="int",
+            default=20,
+            help=u"Number of functions / allocation sites printed by --profile and --mem"
+        ),
+        make_option("--timing",
+            action="store_true",
+            default=False,
+            help=u"Print wall and CPU time per phase"
+        ),
+        make_option("--mem",
+            action="store_true",
+            default=False,
+            help=u"Print the peak memory, and the top allocation sites if tracemalloc is available"
+        ),
+        make_option("--resume",
+            action="store_true",
+            default=False,
+            help=u"Resume checkpointed iterations from their last checkpoint"
+        ),
+        make_option("--checkpoint-file",
+            default=None,
+            help=u"Checkpoint file path (default: <logger name>.checkpoint in the current directory)"
+        ),
+        make_option("--async-log",
+            action="store_true",
+            default=False,
+            help=u"Run log handlers in a background thread"
+        ),
+        make_option("--log-sample",
+            type="int",
+            default=None,
+            help=u"Only log one of every N debug messages"
+        ),
+        make_option("--log-rate",
+            type="int",
+            default=None,
+            help=u"Log at most N debug messages per second"
+        ),
+    )
+    
     logger_name = None
+    #: If True, logging is asynchronous even without the ``--async-log`` option
+    async_logging = False
     
     def handle(self, *args, **options):
-        self.init_logging(*args, **options)
-        return self.do_handle(*args, **options)
-        
+        self.options = options
+        self._timings = []
+        self._start_rss = None
+        self._log_listeners = []
+        self._log_filters = []
+        try:
+            with self.phase('init_logging'):
+                self.init_logging(*args, **options)
+            profiler, tracemalloc = self.start_profiling(**options)
+            try:
+                with self.phase('do_handle'):
+                    return self.do_handle(*args, **options)
+            finally:
+                self.stop_profiling(profiler, tracemalloc, **options)
+        finally:
+            self.stop_async_logging()
+            for log_filter in self._log_filters:
+                self.logger.removeFilter(log_filter)
+    
+    @contextmanager
+    def phase(self, name):
+        """Context manager that measures the wall and CPU time of a phase, if ``--timing`` is given.
         
+        Subclasses may use it in :meth:`do_handle` to time their own phases.
+        """
+        if not self.options.get('timing'):
+            yield
+            return
+        record = [name, None, None]
+        self._timings.append(record)
+        wall, cpu = time.time(), _cpu_time()
+        try:
+            yield
+        finally:
+            record[1:] = time.time() - wall, _cpu_time() - cpu
+    
+    def start_profiling(self, **options):
+        profiler = tracemalloc = None
+        if options.get('mem'):
+            try:
+                import tracemalloc
+            except ImportError:
+                # Only the peak RSS is reported, see stop_profiling()
+                self._start_rss = _max_rss()
+            else:
+                tracemalloc.start()
+        if options.get('profile') or options.get('profile_file'):
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler, tracemalloc
+    
+    def stop_profiling(self, profiler, tracemalloc, **options):
+        top = options.get('profile_top', 20)
+        if profiler is not None:
+            profiler.disable()
+            if options.get('profile_file'):
+                profiler.dump_stats(options['profile_file'])
+            import pstats
+            stats = pstats.Stats(profiler, stream=self.stderr)
+            stats.sort_stats('cumulative').print_stats(top)
+        if tracemalloc is not None:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stderr.write("Memory: %.1f kB peak, %.1f kB at exit\n" % (peak / 1024., current / 1024.))
+            for stat in snapshot.statistics('lineno')[:top]:
+                self.stderr.write("%s\n" % stat)
+        elif self._start_rss is not None:
+            rss = _max_rss()
+            self.stderr.write("Memory: %d kB peak RSS (+%d kB)\n" % (rss, rss - self._start_rss))
+        if self._timings:
+            self.stderr.write("%-30s %10s %10s\n" % ("phase", "wall (s)", "cpu (s)"))
+            for name, wall, cpu in self._timings:
+                if wall is not None:
+                    self.stderr.write("%-30s %10.3f %10.3f\n" % (name, wall, cpu))
         
     def init_logging(self, *args, **options):
         self.logger = logging.getLogger(self.get_logger_name())
         if options['verbosity'] == "3":
             logging.getLogger().setLevel(logging.DEBUG)    
+        if options.get('log_sample'):
+            self._log_filters.append(SamplingFilter(options['log_sample']))
+        if options.get('log_rate'):
+            self._log_filters.append(RateLimitFilter(options['log_rate']))
+        for log_filter in self._log_filters:
+            self.logger.addFilter(log_filter)
+        if self.async_logging or options.get('async_log'):
+            self.start_async_logging()
+    
+    def start_async_logging(self):
+        """Replaces the root and command loggers handlers by queue handlers, consumed by listener threads"""
+        for logger in (logging.getLogger(), self.logger):
+            handlers = logger.handlers[:]
+            if not handlers:
+                continue
+            queue = Queue.Queue()
+            listener = QueueListener(queue, *handlers)
+            logger.handlers = [QueueHandler(queue)]
+            listener.start()
+            self._log_listeners.append((logger, handlers, listener))
+    
+    def stop_async_logging(self):
+        """Flushes the logging queues and restores the loggers handlers"""
+        while self._log_listeners:
+            logger, handlers, listener = self._log_listeners.pop()
+            listener.stop()
+            logger.handlers = handlers
     
     def get_logger_name(self):
         if self.logger_name is not None:
@@ -65,24 +477,184 @@ class ExtendedBaseCommand(BaseCommand):
     def do_handle(self, *args, **options):
         raise NotImplementedError(u"Subclasses must override ExtendedBaseCommand.do_handle()")
     
+    def iter_checkpointed(self, queryset, chunk_size=1000):
+        """Iterates over `queryset` by primary key ordered chunks, with bounded memory.
+        
+        The last primary key of each chunk is written to the checkpoint file once the chunk is
+        consumed, so that an interrupted iteration restarts from there with ``--resume``
+        (the interrupted chunk is processed again). Throughput is logged after each chunk.
+        The checkpoint file is removed when the iteration completes.
+        """
+        path = self.get_checkpoint_file()
+        last_pk = self.read_checkpoint(path) if self.options.get('resume') else None
+        if last_pk is not None:
+            self.logger.info(u"Resuming after pk %s", last_pk)
+        queryset = queryset.order_by('pk')
+        total = (queryset if last_pk is None else queryset.filter(pk__gt=last_pk)).count()
+        done, start = 0, time.time()
+        while True:
+            qs = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            chunk = list(qs[:chunk_size])
+            if not chunk:
+                break
+            for obj in chunk:
+                yield obj
+            last_pk = chunk[-1].pk
+            self.write_checkpoint(path, last_pk)
+            done += len(chunk)
+            rate = done / max(time.time() - start, 1e-6)
+            self.logger.info(u"%d/%d rows (%.0f rows/s, ETA %ds)", done, total, rate, max(total - done, 0) / rate)
+        if os.path.exists(path):
+            os.remove(path)
     
+    def get_checkpoint_file(self):
+        return self.options.get('checkpoint_file') or '%s.checkpoint' % self.get_logger_name()
     
+    def read_checkpoint(self, path):
+        """Returns the last primary key recorded in the checkpoint file, or None"""
+        try:
+            with open(path) as f:
+                return json.load(f)['last_pk']
+        except (IOError, ValueError, KeyError):
+            return None
     
+    def write_checkpoint(self, path, last_pk):
+        # Write then rename, so that a crash never leaves a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'last_pk': last_pk}, f)
+        os.rename(tmp_path, path)
+
+
+#: The command run by the pool workers (inherited from the parent process when forking)
+_current_command = None
+
+def _execute_chunk(item):
+    return _current_command.execute_chunk(item)
+
+def _init_worker():
+    # Listener threads don't survive the fork : workers log synchronously
+    listeners = _current_command._log_listeners
+    while listeners:
+        logger, handlers, listener = listeners.pop()
+        for handler in handlers:
+            # The lock may have been held by a listener thread when forking
+            handler.createLock()
+        logger.handlers = handlers
+
+class ParallelCommand(ExtendedBaseCommand):
+    """
+    Command that processes chunks of work on a pool of processes (``--workers``).
     
+    Subclasses implement :meth:`process_chunk` and either :meth:`get_queryset`, which will
+    be split in primary key ranges of ``--chunk-size`` rows, or :meth:`get_chunks`.
+    Chunks and results must be picklable. Failed chunks are retried ``--retries`` times.
+    """
     
+    option_list = ExtendedBaseCommand.option_list + (
+        make_option("--workers",
+            type="int",
+            default=multiprocessing.cpu_count(),
+            help=u"Number of worker processes (default: number of CPUs)"
+        ),
+        make_option("--chunk-size",
+            type="int",
+            default=1000,
+            help=u"Number of rows per chunk"
+        ),
+        make_option("--retries",
+            type="int",
+            default=2,
+            help=u"Number of times failed chunks are retried"
+        ),
+    )
     
+    def do_handle(self, *args, **options):
+        self.args = args
+        chunks = list(self.get_chunks(*args, **options))
+        self.logger.info(u"Processing %d chunks with %d workers", len(chunks), options['workers'])
+        results = self.run_chunks(chunks, options['workers'], options['retries'])
+        return self.aggregate(results)
     
+    def get_queryset(self, *args, **options):
+        raise NotImplementedError(u"Subclasses must override ParallelCommand.get_queryset() or get_chunks()")
     
+    def get_chunks(self, *args, **options):
+        """Returns a list of chunks. Defaults to ``(first pk, last pk)`` ranges of :meth:`get_queryset`."""
+        pks = list(self.get_queryset(*args, **options).order_by('pk').values_list('pk', flat=True))
+        size = options['chunk_size']
+        return [(pks[i], pks[min(i + size, len(pks)) - 1]) for i in xrange(0, len(pks), size)]
     
+    def get_chunk_queryset(self, chunk):
+        """Returns the :meth:`get_queryset` rows of a primary key range chunk"""
+        first, last = chunk
+        return self.get_queryset(*self.args, **self.options).filter(pk__gte=first, pk__lte=last)
     
+    def process_chunk(self, chunk, *args, **options):
+        """Processes a chunk (in a worker process) and returns a picklable result"""
+        raise NotImplementedError(u"Subclasses must override ParallelCommand.process_chunk()")
     
+    def aggregate(self, results):
+        """Called with the list of chunk results, in chunk order. The returned value is the command output."""
+        pass
     
+    def execute_chunk(self, item):
+        index, chunk = item
+        try:
+            return index, chunk, True, self.process_chunk(chunk, *self.args, **self.options)
+        except Exception:
+            error = traceback.format_exc()
+            # A failed query may leave the connection in an aborted transaction,
+            # that would fail the next chunks (and retries) of this process
+            for connection in connections.all():
+                try:
+                    transaction.rollback_unless_managed(using=connection.alias)
+                except DatabaseError:
+                    connection.close()
+            return index, chunk, False, error
     
+    def run_chunks(self, chunks, workers, retries):
+        results = {}
+        pending = list(enumerate(chunks))
+        attempt = 0
+        while pending:
+            failed = []
+            for index, chunk, ok, result in self.map_chunks(pending, workers):
+                if ok:
+                    results[index] = result
+                    self.logger.debug(u"Chunk %s done (%d/%d)", chunk, len(results), len(chunks))
+                else:
+                    self.logger.error(u"Chunk %s failed:\n%s", chunk, result)
+                    failed.append((index, chunk))
+            if failed:
+                if attempt >= retries:
+                    raise CommandError(u"%d chunks failed" % len(failed))
+                attempt += 1
+                self.logger.warning(u"Retrying %d failed chunks (%d/%d)", len(failed), attempt, retries)
+            pending = failed
+        return [results[index] for index in xrange(len(chunks))]
     
-    
-    
-    
-    
-
-
+    def map_chunks(self, items, workers):
+        """Yields the :meth:`execute_chunk` results of `items`, processed by `workers` processes"""
+        global _current_command
+        if workers <= 1:
+            for item in items:
+                yield self.execute_chunk(item)
+            return
+        # Children must not share the parent connections : close them before forking,
+        # each process will open its own when needed.
+        for connection in connections.all():
+            connection.close()
+        _current_command = self
+        pool = multiprocessing.Pool(workers, _init_worker)
+        try:
+            for result in pool.imap_unordered(_execute_chunk, items):
+                yield result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _current_command = None
 
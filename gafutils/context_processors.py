@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""Template context processors."""
+
+from gafutils.views.breadcrumbs import get_request_breadcrumbs
+
+def breadcrumbs(request):
+    """Adds the ``url_breadcrumbs`` of the request, built from the urlconf.
+    
+    A different name than ``breadcrumbs`` is used so that views can still pass their own.
+    """
+    return {'url_breadcrumbs': get_request_breadcrumbs(request)}
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""A daemon that runs management commands in a warmed-up Django process.
+
+The server (see the ``command_daemon`` management command) boots Django, imports
+the apps, urls and commands, discovers the registries, then listens on a UNIX socket.
+For each client connection, it forks a child that runs the requested command, streaming
+its stdout/stderr back to the client, and sends its exit code. Short commands
+don't pay the Django startup time anymore.
+
+The client doesn't import Django::
+
+    $ python -m gafutils.daemon [--socket PATH] <command> [args...]
+
+Limitations: stdin is not forwarded, only ``sys.stdout``/``sys.stderr`` writes are
+streamed (not subprocesses output nor log handlers configured at startup), and
+the settings module is the daemon one.
+"""
+import errno
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import traceback
+
+def _default_socket():
+    # A per-user directory : in a shared temp directory, another user could create the socket first
+    directory = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(os.path.expanduser('~'), '.gafutils')
+    return os.path.join(directory, 'gafutils-daemon.sock')
+
+#: Default socket path, in ``$XDG_RUNTIME_DIR`` or ``~/.gafutils/``.
+#: Overridden by the GAFUTILS_DAEMON_SOCKET environment variable.
+DEFAULT_SOCKET = os.environ.get('GAFUTILS_DAEMON_SOCKET') or _default_socket()
+
+# Frame kinds
+REQUEST = 'r'
+STDOUT = 'o'
+STDERR = 'e'
+EXIT = 'x'
+
+_HEADER = struct.Struct('!cI')
+
+def send_frame(sock, kind, data):
+    sock.sendall(_HEADER.pack(kind, len(data)) + data)
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+def recv_frame(sock):
+    """Returns a ``(kind, data)`` tuple. Raises :exc:`EOFError` if the connection is closed."""
+    kind, size = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return kind, _recv_exactly(sock, size)
+
+class FrameWriter(object):
+    """File-like object that sends what is written as frames of the given kind"""
+    
+    def __init__(self, sock, kind):
+        self.sock = sock
+        self.kind = kind
+    
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if data:
+            send_frame(self.sock, self.kind, data)
+    
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+    
+    def flush(self):
+        pass
+    
+    def isatty(self):
+        return False
+
+
+# Server
+# -----------------------------------------------------------------------------
+
+class CommandServer(object):
+    
+    def __init__(self, path=DEFAULT_SOCKET, logger=None):
+        import logging
+        self.path = path
+        self.logger = logger or logging.getLogger('gafutils.daemon')
+        self.running = False
+        self.children = set()
+    
+    def serve_forever(self, poll_interval=0.5):
+        from django.db import connections
+        
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(077) # Only our user may run commands
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        sock.listen(128)
+        sock.settimeout(poll_interval)
+        self.logger.info(u"Listening on %s", self.path)
+        self.running = True
+        try:
+            while self.running:
+                self.reap_children()
+                try:
+                    conn, _ = sock.accept()
+                except socket.timeout:
+                    continue
+                except socket.error:
+                    if self.running:
+                        raise
+                    break
+                conn.settimeout(None)
+                # Children must not share our connections
+                for connection in connections.all():
+                    connection.close()
+                pid = os.fork()
+                if pid == 0:
+                    # Don't inherit the server handlers (e.g. SIGTERM only shutting the server down)
+                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                    signal.signal(signal.SIGINT, signal.SIG_DFL)
+                    sock.close()
+                    code = 1
+                    try:
+                        code = self.handle(conn)
+                    finally:
+                        os._exit(code)
+                conn.close()
+                self.children.add(pid)
+        finally:
+            sock.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+    
+    def shutdown(self):
+        self.running = False
+    
+    def reap_children(self):
+        for pid in list(self.children):
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                self.children.discard(pid)
+    
+    def handle(self, conn):
+        """Runs the requested command (in the child process) and returns its exit code"""
+        import random
+        from django.core.management import ManagementUtility
+        
+        random.seed()
+        kind, data = recv_frame(conn)
+        request = json.loads(data)
+        # The settings are already loaded : keep them
+        settings_module = os.environ.get('DJANGO_SETTINGS_MODULE')
+        os.environ.clear()
+        os.environ.update(request['env'])
+        if settings_module:
+            os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+        os.chdir(request['cwd'])
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = FrameWriter(conn, STDOUT), FrameWriter(conn, STDERR)
+        try:
+            try:
+                ManagementUtility([request['prog']] + request['argv']).execute()
+                code = 0
+            except SystemExit, e:
+                if e.code is None:
+                    code = 0
+                elif isinstance(e.code, int):
+                    code = e.code
+                else:
+                    sys.stderr.write("%s\n" % e.code)
+                    code = 1
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            send_frame(conn, EXIT, str(code))
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            conn.close()
+        return code
+
+
+# Client
+# -----------------------------------------------------------------------------
+
+def run_command(argv, path=DEFAULT_SOCKET, stdout=None, stderr=None, prog='manage.py'):
+    """Runs a command in the daemon listening at `path` and returns its exit code.
+    
+    Raises :exc:`socket.error` if the socket doesn't belong to the current user, as the request
+    holds the whole environment.
+    """
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    if os.stat(path).st_uid != os.getuid():
+        raise socket.error(errno.EACCES, "%s is owned by another user" % path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    try:
+        send_frame(sock, REQUEST, json.dumps({
+            'prog': prog,
+            'argv': list(argv),
+            'env': dict(os.environ),
+            'cwd': os.getcwd(),
+        }))
+        while True:
+            try:
+                kind, data = recv_frame(sock)
+            except EOFError:
+                stderr.write("gafutils daemon: connection closed before the command exited\n")
+                return 1
+            if kind == STDOUT:
+                stdout.write(data)
+                stdout.flush()
+            elif kind == STDERR:
+                stderr.write(data)
+                stderr.flush()
+            elif kind == EXIT:
+                return int(data)
+    finally:
+        sock.close()
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    path = DEFAULT_SOCKET
+    if argv[:1] == ['--socket'] and len(argv) > 1:
+        path = argv[1]
+        argv = argv[2:]
+    if not argv:
+        sys.stderr.write("usage: python -m gafutils.daemon [--socket PATH] <command> [args...]\n")
+        return 2
+    try:
+        return run_command(argv, path)
+    except (socket.error, OSError), e:
+        sys.stderr.write("gafutils daemon: can't connect to %s: %s\n" % (path, e))
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -34,6 +34,7 @@ from django.core.exceptions import SuspiciousOperation
 from django.db import models
 from django.db.models.signals import pre_save, pre_delete
 from django.dispatch.dispatcher import receiver
+from gafutils.instrumentation import measure
 
 class DefaultObjectField(models.BooleanField):
     """Boolean field that sets a default object for a given model.
@@ -63,26 +64,32 @@ except ImportError:
 def pre_save_callback(sender, **kwargs):
     instance = kwargs['instance']
     default_object_fields = getattr(instance, '_default_object_fields', ())
-    for fname in default_object_fields: # Check for unique field value
-        field = instance._meta.get_field_by_name(fname)[0]
-        qs = field.model._default_manager.filter(**{fname: True})
-        if instance.pk is not None:
-            qs = qs.exclude(pk=instance.pk)
-        exists = qs.exists()
-        if getattr(instance, fname):
-            # This object is or will become the default one
-            if exists:
-                # Another default object exists, set it normal 
-                qs.update(**{fname: False})
-        elif not exists:
-            # No default object exists, force this one as default
-            setattr(instance, fname, True)
+    if not default_object_fields:
+        return
+    with measure('default_object.pre_save'):
+        for fname in default_object_fields: # Check for unique field value
+            field = instance._meta.get_field_by_name(fname)[0]
+            qs = field.model._default_manager.filter(**{fname: True})
+            if instance.pk is not None:
+                qs = qs.exclude(pk=instance.pk)
+            exists = qs.exists()
+            if getattr(instance, fname):
+                # This object is or will become the default one
+                if exists:
+                    # Another default object exists, set it normal 
+                    qs.update(**{fname: False})
+            elif not exists:
+                # No default object exists, force this one as default
+                setattr(instance, fname, True)
     
 @receiver(pre_delete)
 def pre_delete_callback(sender, **kwargs):
     instance = kwargs['instance']
     default_object_fields = getattr(instance, '_default_object_fields', ())
-    for fname in default_object_fields:
-        if getattr(instance, fname):
-            raise SuspiciousOperation(
-                u"Can't delete default %s object" % instance._meta)
+    if not default_object_fields:
+        return
+    with measure('default_object.pre_delete'):
+        for fname in default_object_fields:
+            if getattr(instance, fname):
+                raise SuspiciousOperation(
+                    u"Can't delete default %s object" % instance._meta)
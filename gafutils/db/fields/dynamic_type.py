@@ -24,8 +24,13 @@ Example
 """
 
 
+import datetime
+import decimal
+
 from django.db import models
+from django.db.models.signals import class_prepared
 from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import force_unicode
 from django.utils.functional import curry
 
 # Default type identifiers
@@ -33,6 +38,11 @@ BOOLEAN = 'bool'
 STRING = 'str'
 INTEGER = 'int'
 FLOAT = 'float'
+BIGINT = 'bigint'
+DECIMAL = 'decimal'
+DATE = 'date'
+DATETIME = 'datetime'
+JSON = 'json'
 
 #: Default type map
 TYPE_MAP = {
@@ -40,10 +50,68 @@ TYPE_MAP = {
     STRING:  models.TextField,
     INTEGER:  models.IntegerField,
     FLOAT: models.FloatField,
+    BIGINT: models.BigIntegerField,
+    DECIMAL: models.DecimalField,
+    DATE: models.DateField,
+    DATETIME: models.DateTimeField,
 }
 
+try:
+    from django_extensions.db.fields.json import JSONField
+    TYPE_MAP[JSON] = JSONField
+except ImportError:
+    pass
+
 ALL_TYPES = TYPE_MAP.keys()
 
+#: Types handled when neither `types` nor `field_map` is given.
+#: Other types must be explicitly asked for, so that existing tables don't get new columns.
+DEFAULT_TYPES = (BOOLEAN, STRING, INTEGER, FLOAT)
+
+#: Extra options given to auto-created fields constructors
+TYPE_FIELD_OPTIONS = {
+    DECIMAL: {'max_digits': 30, 'decimal_places': 10},
+}
+
+def _coercer(field_class, fast_types, **field_options):
+    """Returns a function that converts a value for the given field class.
+    
+    Values which type is exactly one of `fast_types` (or None) are returned as is,
+    others are converted by the field :meth:`to_python` method.
+    """
+    field = field_class(**field_options)
+    def coerce(value):
+        if value is None or value.__class__ in fast_types:
+            return value
+        return field.to_python(value)
+    return coerce
+
+def _coerce_string(value):
+    if value is None or value.__class__ is unicode:
+        return value
+    return force_unicode(value)
+
+#: <type identifier> -> <coercion function> mapping used by :meth:`DynamicTypeField.set_value`.
+#: Types that are not in this map are not converted.
+COERCE_MAP = {
+    BOOLEAN: _coercer(models.NullBooleanField, (bool,)),
+    STRING: _coerce_string,
+    INTEGER: _coercer(models.IntegerField, (int, long)),
+    FLOAT: _coercer(models.FloatField, (float,)),
+    BIGINT: _coercer(models.BigIntegerField, (int, long)),
+    DECIMAL: _coercer(models.DecimalField, (decimal.Decimal,)),
+    DATE: _coercer(models.DateField, (datetime.date,)),
+    DATETIME: _coercer(models.DateTimeField, (datetime.datetime,)),
+}
+
+#: NumPy dtypes used by :meth:`DynamicTypeField.to_arrays`. Other types are exported as ``object`` arrays.
+NUMPY_DTYPES = {
+    BOOLEAN: 'bool',
+    INTEGER: 'int64',
+    FLOAT: 'float64',
+    BIGINT: 'int64',
+}
+
 class DynamicTypeFieldDescriptor(object):
     """
     Used by :class:`.DynamicTypeField` to make its value available as a model attribute.
@@ -63,11 +131,15 @@ class DynamicTypeFieldDescriptor(object):
 class DynamicTypeField(object):
     
     type_map_override = None
+    coerce_map_override = None
     
     def __init__(self, types=None, exclude_types=None, type_callback=None,
                  create_fields=True, field_map=None, **field_options):
         """
-        :param types: A list of type identifiers (type map keys) that limits the handled value types.
+        :param types:
+            A list of type identifiers (type map keys) that limits the handled value types.
+            If neither `types` nor `field_map` is given, :data:`DEFAULT_TYPES` and
+            the `type_map_override` types are handled.
         :param excluded_types: A list of type identifiers to exclude (even if in `types`).
         :param type_callback:
             A callable that takes a model instance attribute and returns the
@@ -84,17 +156,21 @@ class DynamicTypeField(object):
         
         self.type_map = TYPE_MAP.copy()
         self.type_map.update(self.type_map_override or {})
+        self.coerce_map = COERCE_MAP.copy()
+        self.coerce_map.update(self.coerce_map_override or {})
         
         #: <type identifier> -> <field name> mapping
         self.fields = {}
 
         if field_map is None:
+            if types is None:
+                types = DEFAULT_TYPES + tuple(self.type_map_override or ())
             field_map = dict( (type_id, None) for type_id in self.type_map.iterkeys() )
         
         for type_id, fname in field_map.iteritems():
             if exclude_types is not None and type_id in exclude_types:
                 continue
-            if types is not None and type_id not in exclude_types:
+            if types is not None and type_id not in types:
                 continue
             self.fields[type_id] = fname
 
@@ -107,6 +183,8 @@ class DynamicTypeField(object):
         }
         field_defaults.update(field_options)
         self.field_options = field_defaults
+        
+        self._metadata = None
     
     def contribute_to_class(self, cls, name):
         """Adds a value accessor to the class and eventually creates the db fields. 
@@ -121,6 +199,38 @@ class DynamicTypeField(object):
             if self.auto_create_fields:
                 field = self.create_field(type_id)
                 field.contribute_to_class(cls, fname)
+        class_prepared.connect(self._class_prepared, sender=cls)
+
+    def _class_prepared(self, sender, **kwargs):
+        self.invalidate_metadata()
+        self._get_metadata()
+
+    def invalidate_metadata(self):
+        """Clears the cached metadata (:attr:`field_names`, :attr:`field_instances`, etc.).
+        
+        Must be called if :attr:`fields` or :attr:`type_map` are changed once the model class is prepared.
+        """
+        self._metadata = None
+
+    def _get_metadata(self):
+        if self._metadata is None:
+            opts = self.model._meta
+            names = tuple(self.fields.values())
+            instances = dict((name, opts.get_field(name)) for name in names)
+            self._metadata = (
+                names,
+                dict((fname, type_id) for type_id, fname in self.fields.iteritems()),
+                instances,
+                tuple(instances[name] for name in names),
+            )
+        return self._metadata
+
+    #: Tuple of the handled db field names
+    field_names = property(lambda self: self._get_metadata()[0])
+    #: <field name> -> <type identifier> mapping
+    column_types = property(lambda self: self._get_metadata()[1])
+    #: <field name> -> :class:`models.Field` instance mapping
+    field_instances = property(lambda self: self._get_metadata()[2])
 
     def construct_field_name(self, type_id):
         """Returns the default db field name for the given type identifier"""
@@ -136,7 +246,8 @@ class DynamicTypeField(object):
             Will be merged with self.field_options and passed to the field constructor
         """
         field_class = self.type_map[type_id]
-        opts = self.field_options.copy()
+        opts = TYPE_FIELD_OPTIONS.get(type_id, {}).copy()
+        opts.update(self.field_options)
         opts.update(kwargs)
         return field_class(**opts)
 
@@ -172,12 +283,16 @@ class DynamicTypeField(object):
         return getattr(instance, self.get_field_name(instance))
     
     def set_value(self, instance, value):
-        """Sets the appropriate field value""" 
-        setattr(instance, self.get_field_name(instance), value)
+        """Sets the appropriate field value, converted by the type coercion function""" 
+        type_id = self.get_type_id(instance)
+        coerce = self.coerce_map.get(type_id)
+        if coerce is not None:
+            value = coerce(value)
+        setattr(instance, self.fields[type_id], value)
 
     def get_field(self, instance):
         """Returns the current :class:`models.Field` instance"""
-        return self.get_field_by_name(self.get_field_name(instance))[0]
+        return self.field_instances[self.get_field_name(instance)]
 
     def get_field_name(self, instance):
         """Returns the current db field name"""
@@ -185,13 +300,113 @@ class DynamicTypeField(object):
 
     def get_fields(self):
         """Returns the list of associated :class:`models.Field` instances"""
-        return [self.get_field_by_name(name) for name in self.get_field_names()]    
+        return list(self._get_metadata()[3])
     
     def get_field_names(self):
         """Returns the list of handled db field names"""
-        return self.fields.values()
+        return list(self.field_names)
 
     def get_field_by_name(self, name):
         """Returns the :class:`models.Field` instance with the given name"""
-        return self.model._meta.get_field_by_name(name)[0]
+        try:
+            return self.field_instances[name]
+        except KeyError:
+            return self.model._meta.get_field_by_name(name)[0]
+
+    def get_type_field_name(self):
+        """Returns the name of the db field holding the type identifier (``FOO_type``), or None"""
+        name = '%s_type' % self.name
+        if name in [f.name for f in self.model._meta.fields]:
+            return name
+        return None
+
+    def to_arrays(self, queryset, type_field=None, chunk_size=2000):
+        """Exports the values of `queryset` as NumPy arrays, grouped by type identifier.
+        
+        Rows are fetched by chunks of `chunk_size` with ``values_list()``, ordered
+        by primary key, so no model instance is ever built.
+        NumPy is only needed when this method is called.
+        
+        :param queryset: a queryset of our model
+        :param str type_field:
+            The name of the db field holding the type identifier. Defaults
+            to ``FOO_type`` if the model has such a field. Without it, the queryset
+            model must define a constant ``FOO_type`` class attribute (as
+            ``IntValueHolder`` does), used for every row: types given by a
+            `type_callback` can't be resolved without instances.
+        :param int chunk_size: the number of rows fetched per query
+        :returns:
+            A ``{<type identifier>: (pks, values)}`` dict. ``values`` is a
+            :class:`numpy.ma.MaskedArray` (null values being masked) for types
+            in :data:`NUMPY_DTYPES` and an ``object`` array otherwise.
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImproperlyConfigured(u"DynamicTypeField.to_arrays() requires NumPy")
+        
+        if type_field is None:
+            type_field = self.get_type_field_name()
+        if type_field:
+            type_ids = list(self.fields.keys())
+        else:
+            type_ids = [self._get_constant_type_id(queryset.model)]
+        columns = ['pk'] + ([type_field] if type_field else []) + [self.fields[t] for t in type_ids]
+        offset = len(columns) - len(type_ids)
+        positions = dict((t, offset + i) for i, t in enumerate(type_ids))
+        chunks = dict((t, ([], [])) for t in type_ids)
+        
+        queryset = queryset.order_by('pk')
+        last_pk = None
+        while True:
+            qs = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            rows = list(qs.values_list(*columns)[:chunk_size])
+            if not rows:
+                break
+            if type_field:
+                by_type = dict((t, []) for t in type_ids)
+                for row in rows:
+                    if row[1] in by_type:
+                        by_type[row[1]].append(row)
+            else:
+                by_type = {type_ids[0]: rows}
+            for type_id, type_rows in by_type.iteritems():
+                if type_rows:
+                    pks, values = chunks[type_id]
+                    pos = positions[type_id]
+                    pks.append(numpy.array([row[0] for row in type_rows]))
+                    values.append(self._values_to_array(numpy, type_id, [row[pos] for row in type_rows]))
+            last_pk = rows[-1][0]
+            if len(rows) < chunk_size:
+                break
+        
+        arrays = {}
+        for type_id, (pks, values) in chunks.iteritems():
+            if not pks:
+                arrays[type_id] = (numpy.array([], dtype='int64'), self._values_to_array(numpy, type_id, []))
+            elif type_id in NUMPY_DTYPES:
+                arrays[type_id] = (numpy.concatenate(pks), numpy.ma.concatenate(values))
+            else:
+                arrays[type_id] = (numpy.concatenate(pks), numpy.concatenate(values))
+        return arrays
+
+    def _get_constant_type_id(self, model):
+        """Returns the type identifier set by the ``FOO_type`` class attribute of `model`"""
+        type_id = None
+        if self.type_callback is None:
+            type_id = getattr(model, '%s_type' % self.name, None)
+        if type_id is None or callable(type_id) or isinstance(type_id, property) or type_id not in self.fields:
+            raise ImproperlyConfigured(
+                u"%s.to_arrays() needs a type field or a constant %s_type attribute on %s" % (
+                self.__class__.__name__, self.name, model.__name__))
+        return type_id
 
+    def _values_to_array(self, numpy, type_id, values):
+        """Converts a list of db values into a (masked if typed) NumPy array"""
+        dtype = NUMPY_DTYPES.get(type_id)
+        if dtype is None:
+            array = numpy.empty(len(values), dtype=object)
+            array[:] = values
+            return array
+        mask = [v is None for v in values]
+        return numpy.ma.masked_array([0 if v is None else v for v in values], mask=mask, dtype=dtype)
@@ -1,7 +1,121 @@
 # -*- coding: utf-8 -*-
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.deletion import force_managed
 from django.db.models.query import QuerySet
+from django.db.models.signals import pre_delete, post_delete
+from django.db.models.sql.subqueries import DeleteQuery
+from django.dispatch.dispatcher import _make_id
+from gafutils.instrumentation import measure
+from itertools import islice
+
+def _delete_receivers(model):
+    """Returns the pre_delete and post_delete receivers of `model`,
+    except the :mod:`~gafutils.db.fields.default_object` ones that do nothing for models without default object fields."""
+    from gafutils.db.fields import default_object
+    receivers = pre_delete._live_receivers(_make_id(model)) + post_delete._live_receivers(_make_id(model))
+    if not getattr(model, '_default_object_fields', None):
+        receivers = [r for r in receivers if r is not default_object.pre_delete_callback]
+    return receivers
+
+def _table_chain(model):
+    """Returns `model` and its concrete parents, from child to base, or None
+    if `model` can't be deleted without the collector."""
+    chain = []
+    while True:
+        opts = model._meta
+        if _delete_receivers(model) or opts.local_many_to_many or opts.get_all_related_many_to_many_objects():
+            return None
+        for related in opts.get_all_related_objects(include_hidden=True):
+            # Only children tables may point to the model
+            if not (related.field.rel.parent_link and issubclass(related.model, model)):
+                return None
+        chain.append(model)
+        parents = [parent for parent in opts.parents if not parent._meta.abstract]
+        if not parents:
+            return chain
+        if len(parents) > 1:
+            return None
+        model = parents[0]
+
+def _serialized_fields(model, fields):
+    """Returns the names of the `fields` (default: all but keys) of `model`."""
+    names = []
+    for field in model._meta.fields:
+        if fields is None:
+            # children have their parents' primary keys as regular fields
+            if isinstance(field, models.AutoField) or field.primary_key or field.name == 'polymorphic_ctype':
+                continue
+        elif field.name not in fields:
+            continue
+        names.append(field.name)
+    return names
+
+def iter_polymorphic_json(queryset, fields=None, chunk_size=1000, cls=DjangoJSONEncoder):
+    """Serializes a polymorphic `queryset` as a JSON list, without instantiating models.
+    
+    Yields JSON fragments, one per chunk of `chunk_size` records, so that it can be given
+    to an :class:`~django.http.HttpResponse` as its content to stream large exports.
+    Records are serialized in the queryset order as Django serializers do::
+    
+        {"pk": 1, "model": "app.dog", "fields": {"name": "Rex", "barks": true}}
+    
+    For each chunk, the fields are read with one ``values()`` query per concrete type.
+    
+    :param fields: names of the fields to serialize, that concrete types may not all have
+                   (default: all fields but keys)
+    :param cls: the JSON encoder class
+    """
+    encoder = cls()
+    model_fields = {}
+    
+    def encode_chunk(chunk):
+        groups = {}
+        for pk, ctype_id in chunk:
+            groups.setdefault(ctype_id, []).append(pk)
+        rows = {}
+        labels = {}
+        with measure('polymorphism.iter_json'):
+            for ctype_id, pks in groups.iteritems():
+                model = ContentType.objects.get_for_id(ctype_id).model_class()
+                if model not in model_fields:
+                    model_fields[model] = _serialized_fields(model, fields)
+                labels[ctype_id] = u"%s.%s" % (model._meta.app_label, model._meta.object_name.lower())
+                for row in model._default_manager.filter(pk__in=pks).values('pk', *model_fields[model]):
+                    rows[row.pop('pk')] = row
+        return [encoder.encode({'pk': pk, 'model': labels[ctype_id], 'fields': rows[pk]})
+                for pk, ctype_id in chunk if pk in rows]
+    
+    records = queryset.values_list('pk', 'polymorphic_ctype_id').iterator()
+    yield '['
+    separator = ''
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        objects = encode_chunk(chunk)
+        if objects:
+            yield separator + ','.join(objects)
+            separator = ','
+    yield ']'
+
+class _PolymorphicDeleter(object):
+    """Deletes rows table by table, in a transaction as the collector does."""
+    
+    def __init__(self, using):
+        self.using = using
+        self.tables = {}
+        
+    def add(self, chain, pks):
+        for depth, model in enumerate(reversed(chain)):
+            self.tables.setdefault(model, (depth, []))[1].extend(pks)
+            
+    @force_managed
+    def delete(self):
+        # children tables first
+        for model, (depth, pks) in sorted(self.tables.items(), key=lambda item: item[1][0], reverse=True):
+            DeleteQuery(model).delete_batch(pks, self.using)
 
 class PolymorphicQuerySet(QuerySet):
     
@@ -28,19 +142,59 @@ class PolymorphicQuerySet(QuerySet):
 
     def iter_polymorphic(self):
         
-        results = tuple(self.values_list('pk', 'polymorphic_ctype_id'))
-        pks = [r[0] for r in results]
-        ctypes = ContentType.objects.in_bulk(set(r[1] for r in results))
+        with measure('polymorphism.iter_polymorphic'):
+            results = tuple(self.values_list('pk', 'polymorphic_ctype_id'))
+            pks = [r[0] for r in results]
+            ctypes = ContentType.objects.in_bulk(set(r[1] for r in results))
         children = {}
         for pk, ctype_id in results:
             if pk not in children:
                 ctype = ctypes[ctype_id]
                 model = ctype.model_class()
-                for obj in model._default_manager.filter(pk__in=pks):
-                    assert obj.pk not in children
-                    children[obj.pk] = obj
+                with measure('polymorphism.iter_polymorphic'):
+                    for obj in model._default_manager.filter(pk__in=pks):
+                        assert obj.pk not in children
+                        children[obj.pk] = obj
             yield children[pk]
 
+    def iter_json(self, fields=None, chunk_size=1000):
+        """Serializes the queryset as JSON fragments, see :func:`iter_polymorphic_json`."""
+        return iter_polymorphic_json(self, fields, chunk_size)
+
+    def fast_delete(self):
+        """Deletes the records of the queryset with one statement per table (in chunks),
+        grouping them by concrete type from their ``polymorphic_ctype``.
+        
+        Falls back to :meth:`delete` if any concrete type has delete signal receivers, default object fields,
+        many to many fields, or relations other than its children.
+        
+        Returns the number of deleted records.
+        """
+        assert self.query.can_filter(), \
+                "Cannot use 'limit' or 'offset' with delete."
+        with measure('polymorphism.fast_delete'):
+            # Read the records to delete from the database they are deleted from, as delete() does
+            del_query = self._clone()
+            del_query._for_write = True
+            del_query.query.select_related = False
+            del_query.query.clear_ordering()
+            groups = {}
+            for pk, ctype_id in del_query.values_list('pk', 'polymorphic_ctype_id'):
+                groups.setdefault(ctype_id, []).append(pk)
+            count = sum(len(pks) for pks in groups.itervalues())
+            deleter = _PolymorphicDeleter(del_query.db)
+            for ctype_id, pks in groups.iteritems():
+                model = ContentType.objects.get_for_id(ctype_id).model_class()
+                chain = _table_chain(model) if model is not None else None
+                if chain is None:
+                    self.delete()
+                    return count
+                deleter.add(chain, pks)
+            deleter.delete()
+            self._result_cache = None
+            return count
+    fast_delete.alters_data = True
+
 
 class PolymorphicManager(models.Manager):
     
@@ -63,11 +217,13 @@ class PolymorphicModel(models.Model):
     polymorphic_ctype = models.ForeignKey(ContentType, editable=False) 
     
     def save(self, *args, **kwargs):
-        if not self.polymorphic_ctype_id:
-            self.polymorphic_ctype = ContentType.objects.get_for_model(self)
-        super(PolymorphicModel, self).save(*args, **kwargs)
+        with measure('polymorphism.save'):
+            if not self.polymorphic_ctype_id:
+                self.polymorphic_ctype = ContentType.objects.get_for_model(self)
+            super(PolymorphicModel, self).save(*args, **kwargs)
         
     def cast(self):
-        return self.polymorphic_ctype.get_object_for_this_type(pk=self.pk)
+        with measure('polymorphism.cast'):
+            return self.polymorphic_ctype.get_object_for_this_type(pk=self.pk)
     
     
\ No newline at end of file
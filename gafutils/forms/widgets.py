@@ -1,6 +1,18 @@
 # -*- coding: utf-8 -*-
 from django.forms.widgets import CheckboxInput, Textarea
 from django.conf import settings
+from django.core.urlresolvers import reverse, NoReverseMatch
+from django.forms.util import flatatt
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.utils.translation import ugettext as _
+
+def get_json_encoder_class():
+    try:
+        from django_extensions.db.fields.json import JSONEncoder
+    except ImportError:
+        from django.utils.simplejson import JSONEncoder
+    return JSONEncoder
 
 class DefaultObjectAdminWidget(CheckboxInput):
     """Widget intended to select the default object in admin change list.
@@ -23,24 +35,103 @@ class DefaultObjectAdminWidget(CheckboxInput):
 class JsonTextAreaWidget(Textarea):
     """
     To be used with django-extension JSONField. Displays json-formated string with indentation. 
+    
+    Once bound to a saved model instance (see :meth:`bind` and :class:`JsonTextAreaFormMixin`), values
+    whose json is longer than `max_size` characters are displayed as a truncated, disabled preview.
+    The full value can be loaded on demand from the object, through the ``gafutils_json_value`` view
+    (see :mod:`gafutils.urls`). If the form is posted without loading it, the object value is kept.
+    Unbound widgets always display the full value.
+    
+    :param int indent: the indentation, ignored in `compact` mode
+    :param int max_size: the preview size, defaults to the ``JSON_WIDGET_MAX_SIZE`` setting (100000)
+    :param bool compact: renders the json without any whitespace
     """
+    class Media:
+        js = (
+            'gafutils/js/JsonTextAreaWidget.js',
+        )
     
-    def __init__(self, attrs=None, indent=4):
+    def __init__(self, attrs=None, indent=4, max_size=None, compact=False):
         super(JsonTextAreaWidget, self).__init__(attrs)
-        self.indent = 4
+        self.indent = indent
+        self.compact = compact
+        if max_size is None:
+            max_size = getattr(settings, 'JSON_WIDGET_MAX_SIZE', 100000)
+        self.max_size = max_size
+        self.instance = None
+        self.field_name = None
+    
+    def bind(self, instance, field_name):
+        """Binds the widget to the `field_name` field of a model `instance`, allowing truncated previews."""
+        self.instance = instance
+        self.field_name = field_name
         
-    def render(self, name, value, attrs=None):
-        if not isinstance(value, basestring):
-            try:
-                from django_extensions.db.fields.json import JSONEncoder
-            except ImportError:
-                from django.utils.simplejson import JSONEncoder
+    def get_encoder(self):
+        if self.compact:
+            kwargs = {
+                "separators": (',', ':'),
+            }
+        else:
             kwargs = {
                 "indent": self.indent,
             }
-            value = JSONEncoder(**kwargs).encode(value)
-        return super(JsonTextAreaWidget, self).render(name, value, attrs)
-        
+        return get_json_encoder_class()(**kwargs)
+    
+    def encode(self, value, max_size=None):
+        """Returns the json of `value` and whether it was truncated to `max_size`."""
+        if isinstance(value, basestring):
+            if max_size is None:
+                return value, False
+            return value[:max_size], len(value) > max_size
+        if max_size is None:
+            return self.get_encoder().encode(value), False
+        chunks = []
+        size = 0
+        for chunk in self.get_encoder().iterencode(value):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > max_size:
+                return u''.join(chunks)[:max_size], True
+        return u''.join(chunks), False
+    
+    def get_url(self):
+        """Returns the url of the full value, or None if the widget is not bound to a saved object."""
+        if self.instance is None or self.instance.pk is None:
+            return None
+        opts = self.instance._meta
+        try:
+            url = reverse('gafutils_json_value',
+                          args=[opts.app_label, opts.object_name.lower(), self.instance.pk, self.field_name])
+        except NoReverseMatch:
+            return None
+        if not self.compact:
+            url += '?indent=%d' % self.indent
+        return url
+    
+    def unchanged_name(self, name):
+        return name + '_json_unchanged'
         
+    def render(self, name, value, attrs=None):
+        url = self.get_url()
+        preview, truncated = self.encode(value, self.max_size if url is not None else None)
+        if not truncated:
+            return super(JsonTextAreaWidget, self).render(name, preview, attrs)
+        # The preview has no name : it is never posted
+        final_attrs = self.build_attrs(attrs, disabled='disabled', **{'data-name': name})
+        link = u' <a class="jsonLoad" href="%s">%s</a>' % (escape(url), _(u'Load the full document'))
+        return mark_safe(u'<textarea%s>%s</textarea><input type="hidden" name="%s" value="1" />%s' % (
+            flatatt(final_attrs), escape(preview), escape(self.unchanged_name(name)), link))
+    
+    def value_from_datadict(self, data, files, name):
+        if name not in data and data.get(self.unchanged_name(name)) and self.instance is not None:
+            return self.encode(getattr(self.instance, self.field_name))[0]
+        return super(JsonTextAreaWidget, self).value_from_datadict(data, files, name)
+
+class JsonTextAreaFormMixin(object):
+    """Model form mixin that binds the :class:`JsonTextAreaWidget` widgets of its fields to the form instance."""
     
-    
\ No newline at end of file
+    def __init__(self, *args, **kwargs):
+        super(JsonTextAreaFormMixin, self).__init__(*args, **kwargs)
+        for name, field in self.fields.iteritems():
+            if isinstance(field.widget, JsonTextAreaWidget):
+                field.widget.bind(self.instance, name)
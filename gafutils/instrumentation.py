@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""Query count and timing instrumentation of gafutils components.
+
+Components wrap their work in :func:`measure`::
+
+    with measure('polymorphism.cast'):
+        ...
+
+Measures are reported to the stats sink set by the ``INSTRUMENTATION_SINK`` setting
+(a dotted path to a :class:`StatsSink` subclass) or :func:`set_sink`, and to the
+collectors active in the current thread (see :func:`collect` and :class:`InstrumentationMiddleware`).
+Without any sink nor collector, :func:`measure` is a no-op.
+
+Queries are counted by wrapping the cursors of the connections while measuring, without
+touching their ``queries`` logs.
+"""
+
+from django.conf import settings
+from django.db import connections
+import logging
+import threading
+import time
+
+logger = logging.getLogger('gafutils.instrumentation')
+
+class StatsSink(object):
+    """Base class of stats sinks, that ignores all measures."""
+
+    def record(self, component, queries, duration):
+        """Records that `component` made `queries` queries in `duration` seconds."""
+        pass
+
+class LoggingSink(StatsSink):
+    """Logs each measure to the ``gafutils.instrumentation`` logger at debug level."""
+
+    def record(self, component, queries, duration):
+        logger.debug(u"%s: %d queries in %.2fms", component, queries, duration * 1000)
+
+class Stats(dict):
+    """Per-component stats, as a dict mapping component names to ``[calls, queries, duration]`` lists.
+
+    The queries of a component include those of the components it calls.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Stats, self).__init__(*args, **kwargs)
+        self.total_queries = 0
+
+    def record(self, component, queries, duration, own_queries=None):
+        """Records a measure, `own_queries` being its queries not measured by nested components."""
+        self.total_queries += queries if own_queries is None else own_queries
+        try:
+            stat = self[component]
+        except KeyError:
+            self[component] = [1, queries, duration]
+        else:
+            stat[0] += 1
+            stat[1] += queries
+            stat[2] += duration
+
+    def queries(self, component=None):
+        """Returns the query count of `component`, or of all components (nested ones being counted once)."""
+        if component is None:
+            return self.total_queries
+        return self.get(component, (0, 0, 0))[1]
+
+    def __unicode__(self):
+        return u", ".join(u"%s: %d calls, %d queries, %.2fms" % (component, calls, queries, duration * 1000)
+                          for component, (calls, queries, duration) in sorted(self.iteritems()))
+
+_sink = None
+_sink_loaded = False
+_local = threading.local()
+
+def get_sink():
+    """Returns the configured :class:`StatsSink` instance, or None."""
+    global _sink, _sink_loaded
+    if not _sink_loaded:
+        path = getattr(settings, 'INSTRUMENTATION_SINK', None)
+        if path:
+            from gafutils.registry import import_by_path
+            _sink = import_by_path(path)()
+        _sink_loaded = True
+    return _sink
+
+def set_sink(sink):
+    """Sets the :class:`StatsSink` instance, None disabling it."""
+    global _sink, _sink_loaded
+    _sink = sink
+    _sink_loaded = True
+
+def _collectors():
+    try:
+        return _local.collectors
+    except AttributeError:
+        collectors = _local.collectors = []
+        return collectors
+
+class _NoopMeasure(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_noop = _NoopMeasure()
+
+class _CountingCursor(object):
+    """Cursor wrapper counting executed queries in the current thread."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, *args):
+        _local.queries += 1
+        return self.cursor.execute(*args)
+
+    def executemany(self, *args):
+        _local.queries += 1
+        return self.cursor.executemany(*args)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+def _counting_cursor(cursor):
+    def wrapper():
+        return _CountingCursor(cursor())
+    return wrapper
+
+def _start_counting():
+    _local.queries = 0
+    _local.connections = []
+    for connection in connections.all():
+        _local.connections.append((connection, connection.__dict__.get('cursor')))
+        connection.cursor = _counting_cursor(connection.cursor)
+
+def _stop_counting():
+    for connection, cursor in _local.connections:
+        if cursor is None:
+            del connection.cursor
+        else:
+            connection.cursor = cursor
+    _local.connections = []
+
+def _measures():
+    try:
+        return _local.measures
+    except AttributeError:
+        measures = _local.measures = []
+        return measures
+
+class _Measure(object):
+
+    __slots__ = ('component', 'sink', 'collectors', 'queries', 'nested_queries', 'start')
+
+    def __init__(self, component, sink, collectors):
+        self.component = component
+        self.sink = sink
+        self.collectors = collectors
+
+    def __enter__(self):
+        measures = _measures()
+        if not measures:
+            _start_counting()
+        measures.append(self)
+        self.queries = _local.queries
+        self.nested_queries = 0
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        duration = time.time() - self.start
+        queries = _local.queries - self.queries
+        measures = _measures()
+        measures.pop()
+        if measures:
+            measures[-1].nested_queries += queries
+        else:
+            _stop_counting()
+        if self.sink is not None:
+            self.sink.record(self.component, queries, duration)
+        for collector in self.collectors:
+            collector.record(self.component, queries, duration, queries - self.nested_queries)
+        return False
+
+def measure(component):
+    """Returns a context manager that measures the queries and time of `component`."""
+    sink = get_sink()
+    collectors = _collectors()
+    if sink is None and not collectors:
+        return _noop
+    return _Measure(component, sink, tuple(collectors))
+
+def start_collecting():
+    """Starts collecting measures made in the current thread, and returns the collecting :class:`Stats`."""
+    stats = Stats()
+    _collectors().append(stats)
+    return stats
+
+def stop_collecting(stats):
+    """Stops collecting measures into `stats`."""
+    collectors = _collectors()
+    for i, collector in enumerate(collectors):
+        if collector is stats:
+            del collectors[i]
+            break
+
+class collect(object):
+    """Context manager collecting measures made in the current thread::
+
+        with collect() as stats:
+            ...
+        stats.queries('default_object.pre_save')
+    """
+
+    def __enter__(self):
+        self.stats = start_collecting()
+        return self.stats
+
+    def __exit__(self, exc_type, exc_value, tb):
+        stop_collecting(self.stats)
+        return False
+
+class InstrumentationMiddleware(object):
+    """Collects the measures made while handling each request, and logs them to the
+    ``gafutils.instrumentation`` logger at info level with the request and its ``stats``.
+    """
+
+    def process_request(self, request):
+        request.gafutils_stats = start_collecting()
+
+    def process_response(self, request, response):
+        stats = getattr(request, 'gafutils_stats', None)
+        if stats is not None:
+            stop_collecting(stats)
+            if stats:
+                logger.info(u"%s %s: %s", request.method, request.path, unicode(stats),
+                            extra={'request': request, 'stats': stats})
+        return response
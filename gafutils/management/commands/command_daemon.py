@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import signal
+from django.conf import settings
+from django.core.management import get_commands, load_command_class
+from django.db import connections
+from django.db.models.loading import get_apps
+from django.utils.importlib import import_module
+from gafutils.commands import ExtendedBaseCommand
+from gafutils.daemon import CommandServer, DEFAULT_SOCKET
+from gafutils.registry import warm_all
+from optparse import make_option
+
+class Command(ExtendedBaseCommand):
+    help = u"Runs a daemon that executes management commands in forks of a warmed-up process " \
+           u"(use `python -m gafutils.daemon <command>` as client)."
+    
+    option_list = ExtendedBaseCommand.option_list + (
+        make_option("--socket",
+            default=DEFAULT_SOCKET,
+            help=u"UNIX socket path (default: %s)" % DEFAULT_SOCKET
+        ),
+    )
+    
+    def do_handle(self, *args, **options):
+        self.warm_up()
+        server = CommandServer(options['socket'], self.logger)
+        signal.signal(signal.SIGTERM, lambda signum, frame: server.shutdown())
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    
+    def warm_up(self):
+        """Imports everything a command may need, so that children don't have to"""
+        get_apps()
+        try:
+            import_module(settings.ROOT_URLCONF)
+        except ImportError:
+            self.logger.warning(u"Can't import urlconf %s", settings.ROOT_URLCONF)
+        for name, app in get_commands().iteritems():
+            try:
+                load_command_class(app, name)
+            except Exception:
+                self.logger.warning(u"Can't load command %s", name, exc_info=True)
+        warm_all()
+        for connection in connections.all():
+            connection.close()
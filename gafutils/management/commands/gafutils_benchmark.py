@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import connection
+from gafutils.benchmarks import scenarios
+from gafutils.commands import ExtendedBaseCommand
+from optparse import make_option
+import json
+
+class Command(ExtendedBaseCommand):
+    help = u"Runs the gafutils benchmark scenarios in a test database, and compares them with a baseline."
+
+    option_list = ExtendedBaseCommand.option_list + (
+        make_option("--scenario",
+            action="append",
+            dest="scenarios",
+            default=[],
+            help=u"Only run this scenario (may be repeated): %s" % ", ".join(s.name for s in scenarios.SCENARIOS)
+        ),
+        make_option("--repeat",
+            type="int",
+            default=5,
+            help=u"Keep the best of N runs (default: 5)"
+        ),
+        make_option("--output",
+            default=None,
+            help=u"Write the results to this JSON file"
+        ),
+        make_option("--baseline",
+            default=None,
+            help=u"Compare the results with this JSON file, written by --output"
+        ),
+        make_option("--threshold",
+            type="float",
+            default=0.2,
+            help=u"Slowdown ratio above which a scenario regressed (default: 0.2)"
+        ),
+        make_option("--allow-non-sqlite",
+            action="store_true",
+            default=False,
+            help=u"Run on a test database of another backend than SQLite (created, and destroyed, without confirmation)"
+        ),
+    )
+
+    def do_handle(self, *args, **options):
+        if 'gafutils_testapp' not in settings.INSTALLED_APPS:
+            raise CommandError(u"The benchmarks need gafutils_testapp in INSTALLED_APPS")
+        if connection.vendor != 'sqlite':
+            if not options['allow_non_sqlite']:
+                raise CommandError(u"The benchmarks run on a %s test database, that would be clobbered without "
+                                   u"confirmation : use --allow-non-sqlite to run them anyway" % connection.vendor)
+            self.logger.warning(u"Benchmarking a %s test database instead of an in-memory SQLite one",
+                                connection.vendor)
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with self.phase('scenarios'):
+                results = scenarios.run(options['scenarios'], options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=4, sort_keys=True)
+
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        comparison = scenarios.compare(results, baseline, options['threshold'])
+        self.stdout.write("%-25s %12s %8s %12s %8s\n" % ("scenario", "time (us)", "queries", "baseline", "change"))
+        for name, result, base, regressed in comparison:
+            if base is None:
+                self.stdout.write("%-25s %12.1f %8d\n" % (name, result['time'] * 1e6, result['queries']))
+            else:
+                change = (result['time'] / base['time'] - 1) * 100 if base['time'] else 0
+                self.stdout.write("%-25s %12.1f %8d %12.1f %+7.1f%%%s\n" % (
+                    name, result['time'] * 1e6, result['queries'], base['time'] * 1e6, change,
+                    " REGRESSION" if regressed else ""))
+
+        regressions = [name for name, result, base, regressed in comparison if regressed]
+        if regressions:
+            raise CommandError(u"%d scenarios regressed: %s" % (len(regressions), ", ".join(regressions)))
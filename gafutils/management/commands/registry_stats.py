@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.loading import get_apps
+from django.utils.importlib import import_module
+from gafutils.commands import ExtendedBaseCommand
+from gafutils.registry import get_registries
+from optparse import make_option
+
+SORT_KEYS = ('time', 'memory', 'elements')
+
+class Command(ExtendedBaseCommand):
+    help = u"Discovers the project registries and prints per-app discovery statistics."
+    
+    option_list = ExtendedBaseCommand.option_list + (
+        make_option("--sort",
+            type="choice",
+            choices=SORT_KEYS,
+            default="time",
+            help=u"Sort key: %s (default: time)" % ", ".join(SORT_KEYS)
+        ),
+        make_option("--limit",
+            type="int",
+            default=None,
+            help=u"Only print the N first lines"
+        ),
+    )
+    
+    def do_handle(self, *args, **options):
+        # Registries are created when their modules are imported : load models and urls
+        get_apps()
+        try:
+            import_module(settings.ROOT_URLCONF)
+        except ImportError:
+            self.logger.warning(u"Can't import urlconf %s", settings.ROOT_URLCONF)
+        
+        rows = []
+        for registry in get_registries():
+            name = "%s.%s" % (registry.__class__.__module__, registry.__class__.__name__)
+            if registry._discover_status == registry.NOT_DISCOVERED:
+                try:
+                    registry.autodiscover()
+                except ImproperlyConfigured, e:
+                    self.logger.warning(u"%s: %s", name, e)
+                    continue
+            for stat in registry.discovery_stats():
+                rows.append((name, stat))
+        
+        rows.sort(key=lambda row: row[1][options['sort']], reverse=True)
+        if options['limit'] is not None:
+            rows = rows[:options['limit']]
+        
+        self.stdout.write("%-50s %-30s %10s %12s %9s\n" % ("registry", "app", "time (ms)", "memory (kB)", "elements"))
+        for name, stat in rows:
+            self.stdout.write("%-50s %-30s %10.1f %12d %9d\n" % (
+                name, stat['app'], stat['time'] * 1000, stat['memory'], stat['elements']))
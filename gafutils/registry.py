@@ -4,15 +4,199 @@
 ..see:: inspired from pypi.python.org/pypi/django-appregister
 """
 from collections import Mapping, Sized, Iterable, Container
+from contextlib import contextmanager
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.dispatch import Signal
 from django.utils.importlib import import_module
 from django.utils.module_loading import module_has_submodule
+from gafutils.instrumentation import measure
 from functools import wraps
+from inspect import getmro
+from types import ClassType
+import gc
+import imp
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+logger = logging.getLogger('gafutils.registry')
+
+#: Sent once a registry is discovered, with the list of per-app `stats` (see :meth:`BaseRegistry.discovery_stats`)
+registry_discovered = Signal(providing_args=['stats'])
+
+#: All registry instances, by id (dict registries are not hashable)
+_registries = weakref.WeakValueDictionary()
+
+def get_registries():
+    """Returns the list of existing registry instances"""
+    return _registries.values()
+
+def warm_all(resolve_lazy=True, freeze=False, registries=None):
+    """Discovers all the existing registries, including those that are not `autoload`.
+    
+    Intended to be called in the master process of a preforking server (e.g. from the
+    wsgi module with gunicorn ``--preload``), so that workers start with discovered registries
+    and share their memory pages copy-on-write.
+    
+    :param resolve_lazy: imports the elements registered with :meth:`DictRegistry.register_lazy`
+    :param freeze: freezes the discovered registries (see :meth:`BaseRegistry.freeze`), registries
+                   without `discover_module` being left as is
+    :param registries: the registries to warm, defaults to :func:`get_registries`
+    """
+    if registries is None:
+        registries = get_registries()
+    for registry in registries:
+        if not registry.discover_module:
+            continue
+        with registry._locked():
+            if registry._discover_status == registry.NOT_DISCOVERED:
+                registry.autodiscover()
+        if resolve_lazy:
+            registry._resolve_all()
+        if freeze:
+            registry.freeze()
+    gc.collect()
+
+def _max_rss():
+    """Returns the peak memory usage of the process, in kilobytes (0 if unknown)"""
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
 
 class AlreadyRegistered(Exception):
     pass
 
+class RegistryFrozen(Exception):
+    pass
+
+class FrozenDict(dict):
+    """A read-only dict"""
+    
+    def _readonly(self, *args, **kwargs):
+        raise TypeError(u"%s is read-only" % self.__class__.__name__)
+    
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+class RegistrySnapshot(object):
+    """An immutable copy of a registry content, at a given version.
+    
+    Snapshots are equal (and have the same hash) if they come from the same registry
+    at the same version, so they can be used as cache keys for derived structures.
+    """
+    __slots__ = ('registry_id', 'version', 'data')
+    
+    def __init__(self, registry, data):
+        self.registry_id = id(registry)
+        self.version = registry.version
+        #: a frozenset or a :class:`FrozenDict`
+        self.data = data
+    
+    def __hash__(self):
+        return hash((self.registry_id, self.version))
+    
+    def __eq__(self, other):
+        return isinstance(other, RegistrySnapshot) and \
+            (self.registry_id, self.version) == (other.registry_id, other.version)
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __iter__(self):
+        return iter(self.data)
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def __contains__(self, element):
+        return element in self.data
+    
+    def __getitem__(self, key):
+        return self.data[key]
+
+def import_by_path(path):
+    """Imports and returns the object at the given dotted `path`"""
+    try:
+        module_path, name = path.rsplit('.', 1)
+    except ValueError:
+        raise ImproperlyConfigured(u"%s is not a valid dotted path" % path)
+    try:
+        return getattr(import_module(module_path), name)
+    except AttributeError:
+        raise ImproperlyConfigured(u"Module %s has no %s attribute" % (module_path, name))
+
+class LazyElement(object):
+    """Placeholder for an element registered by its dotted path, until it is imported."""
+    
+    __slots__ = ('path',)
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def __repr__(self):
+        return "<LazyElement: %s>" % self.path
+    
+    def __eq__(self, other):
+        return isinstance(other, LazyElement) and other.path == self.path
+    
+    def __ne__(self, other):
+        return not self == other
+
+class Index(object):
+    """Base class of registries secondary indexes.
+    
+    An index maps keys to registered elements, so that :meth:`BaseRegistry.by`
+    lookups don't need to scan the registry.
+    """
+    def __init__(self, name):
+        self.name = name
+    
+    def keys(self, element):
+        """Returns the keys under which `element` is indexed"""
+        raise NotImplementedError
+
+class AttributeIndex(Index):
+    """Indexes elements by the value of one of their attributes. Elements without this attribute are not indexed."""
+    def __init__(self, attr, name=None):
+        super(AttributeIndex, self).__init__(name or attr)
+        self.attr = attr
+    
+    def keys(self, element):
+        try:
+            return (getattr(element, self.attr),)
+        except AttributeError:
+            return ()
+
+class SubclassIndex(Index):
+    """Indexes classes (or instances) by their base classes :
+    ``registry.by('subclass', Foo)`` returns the subclasses of ``Foo`` (or its instances).
+    """
+    def __init__(self, name='subclass'):
+        super(SubclassIndex, self).__init__(name)
+    
+    def keys(self, element):
+        if not isinstance(element, (type, ClassType)):
+            element = element.__class__
+        return getmro(element)
+
+class KeyIndex(Index):
+    """Indexes elements by the value returned by a function"""
+    def __init__(self, name, func):
+        super(KeyIndex, self).__init__(name)
+        self.func = func
+    
+    def keys(self, element):
+        return (self.func(element),)
+
 def discover(func):
     @wraps(func)
     def wrapper(registry, *args, **kwargs):
@@ -20,6 +204,62 @@ def discover(func):
         return func(registry, *args, **kwargs)
     return wrapper
 
+def _app_mtimes(apps):
+    """Returns the modification times of the given apps' directories.
+    
+    Adding or removing a module in an app changes its directory mtime.
+    """
+    mtimes = {}
+    for app in apps:
+        path = import_module(app).__file__
+        if os.path.basename(path).startswith('__init__.'):
+            path = os.path.dirname(path)
+        mtimes[app] = os.stat(path).st_mtime
+    return mtimes
+
+def _read_manifest(path, module):
+    """Returns the list of apps that provide `module`, as recorded in the manifest at `path`.
+    
+    Returns None if the manifest doesn't exist, has no entry for `module` or is stale.
+    """
+    try:
+        with open(path) as f:
+            entry = json.load(f)[module]
+    except (IOError, ValueError, KeyError):
+        return None
+    installed_apps = list(settings.INSTALLED_APPS)
+    if entry.get('installed_apps') != installed_apps or entry.get('mtimes') != _app_mtimes(installed_apps):
+        return None
+    return entry['apps']
+
+def _write_manifest(path, module, apps):
+    """Records in the manifest at `path` the list of apps that provide `module`.
+    
+    The manifest being a cache, write errors are only logged.
+    """
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        manifest = {}
+    installed_apps = list(settings.INSTALLED_APPS)
+    manifest[module] = {
+        'installed_apps': installed_apps,
+        'mtimes': _app_mtimes(installed_apps),
+        'apps': apps,
+    }
+    # Write then rename, so that concurrent processes never read a partial file
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmp_path, path)
+    except (IOError, OSError), e:
+        logger.warning(u"Can't write the discovery manifest %s: %s", path, e)
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 class BaseRegistry(Sized, Iterable, Container):
 
     # Autodiscovering statuses
@@ -35,48 +275,151 @@ class BaseRegistry(Sized, Iterable, Container):
     discover_module = None
     #: indicates if autodiscovery must be performed on first regitry access
     autoload = True
+    #: path of the file recording which apps provide the `discover_module`.
+    #: Defaults to the `REGISTRY_DISCOVERY_MANIFEST` setting. If None, all apps are probed at each discovery.
+    discovery_manifest = None
+    #: :class:`Index` instances maintained on registration, to be queried with :meth:`by`
+    indexes = ()
     
     def __init__(self):
         self._discover_status = self.NOT_DISCOVERED
+        self._discover_lock = threading.RLock()
+        self._discovery_stats = []
         self._registry = self.create_registry()
+        #: <index name> -> {<index key>: <set of entries>}
+        self._indexes = dict((index.name, {}) for index in self.indexes)
+        #: incremented each time an element is added or removed
+        self.version = 0
+        self.frozen = False
+        self._snapshot = None
         self.ignore_duplicates = self.ignore_duplicates or getattr(settings, 'REGISTRY_IGNORE_DUPLICATES', False) 
+        _registries[id(self)] = self
+
+    # Special methods are looked up on the class, so they can't be rebound by `_bind_accessors()`.
+    # The status is checked inline, which is cheaper than going through the `discover` decorator.
 
-    @discover
     def __iter__(self):
+        if self._discover_status is not self.DISCOVERED:
+            self._discover()
         return iter(self._registry)
     
     def __len__(self):
+        if self._discover_status is not self.DISCOVERED:
+            self._discover()
         return len(self._registry)
 
     def __contains__(self, element):
+        if self._discover_status is not self.DISCOVERED:
+            self._discover()
         return element in self._registry
 
     def create_registry(self):
         return self.registry_class()
 
+    @contextmanager
+    def _locked(self):
+        """Takes the import lock, then the discovery lock.
+        
+        Discovery imports modules, which needs the import lock. Taking it first avoids a deadlock
+        with a thread importing a module that reads the registry.
+        """
+        imp.acquire_lock()
+        try:
+            with self._discover_lock:
+                yield
+        finally:
+            imp.release_lock()
+
     def _discover(self):
-        if self._discover_status == self.NOT_DISCOVERED and self.autoload:
-            self.autodiscover()
+        # Once discovered, no lock is needed
+        if self._discover_status == self.DISCOVERED or not self.autoload:
+            return
+        # Other threads wait for the discovering one. As the locks are reentrant,
+        # the discovering thread itself may access the registry while importing apps.
+        with self._locked():
+            if self._discover_status == self.NOT_DISCOVERED:
+                self.autodiscover()
 
     def autodiscover(self):
-        if self._discover_status > self.NOT_DISCOVERED:
-            raise RuntimeError(u"autodiscover has already been called")
-        else:
+        with self._locked():
+            if self._discover_status > self.NOT_DISCOVERED:
+                raise RuntimeError(u"autodiscover has already been called")
             self._discover_status = self.DISCOVERING
-        module = self.discover_module
-        if not module:
-            raise ImproperlyConfigured(u"%s _registry must specify 'discover_module'" % self.__class__.__name__)
-        for app in settings.INSTALLED_APPS:
+            self._discovery_stats = []
             try:
-                import_module(".%s" % module, app)
-            except ImportError:
-                if module_has_submodule(import_module(app), module):
-                    raise
-                continue
-        self._discover_status = self.DISCOVERED
+                with measure('registry.discover'):
+                    module = self.discover_module
+                    if not module:
+                        raise ImproperlyConfigured(u"%s _registry must specify 'discover_module'" % self.__class__.__name__)
+                    manifest = self.get_discovery_manifest()
+                    apps = _read_manifest(manifest, module) if manifest else None
+                    if apps is None:
+                        apps = [app for app in settings.INSTALLED_APPS if self._import_app_module(app, module)]
+                        if manifest:
+                            _write_manifest(manifest, module, apps)
+                    else:
+                        for app in apps:
+                            self._import_app_module(app, module, probe=False)
+            except:
+                self._discover_status = self.NOT_DISCOVERED
+                raise
+            self._bind_accessors()
+            self._discover_status = self.DISCOVERED
+        logger.info(u"%s discovered in %.3fs (%d elements)",
+                    self.__class__.__name__, sum(s['time'] for s in self._discovery_stats), len(self._registry))
+        registry_discovered.send(sender=self.__class__, registry=self, stats=self.discovery_stats())
+
+    def discovery_stats(self):
+        """Returns statistics about the last discovery, as a list of dicts (one per probed app) with keys :
+        
+         * ``app``: the app name
+         * ``found``: True if the app provides the `discover_module`
+         * ``time``: import wall time, in seconds
+         * ``memory``: increase of the process peak memory usage, in kilobytes
+         * ``elements``: number of elements registered by the import
+        """
+        return [stat.copy() for stat in self._discovery_stats]
+
+    def get_discovery_manifest(self):
+        return self.discovery_manifest or getattr(settings, 'REGISTRY_DISCOVERY_MANIFEST', None)
+
+    def _import_app_module(self, app, module, probe=True):
+        """Imports the `module` of `app` and records the import statistics.
+        
+        If `probe` is True, returns False if `app` has no such module.
+        """
+        start, rss, count = time.time(), _max_rss(), self._count()
+        found = True
+        try:
+            import_module(".%s" % module, app)
+        except ImportError:
+            if not probe or module_has_submodule(import_module(app), module):
+                raise
+            found = False
+        stat = {
+            'app': app,
+            'found': found,
+            'time': time.time() - start,
+            'memory': _max_rss() - rss,
+            'elements': self._count() - count,
+        }
+        self._discovery_stats.append(stat)
+        logger.debug(u"%s: %s.%s imported in %.3fs (%d elements)", self.__class__.__name__,
+                     app, module, stat['time'], stat['elements'])
+        return found
+
+    def _count(self):
+        """Returns the number of registered elements, without discovering"""
+        return len(self._registry)
+
+    def _bind_accessors(self):
+        """Called once discovered : binds read accessors directly to the underlying datastructure,
+        so that they cost the same as the datastructure ones."""
+        pass
     
     def register(self, element, *args, **kwargs):
         assert self._discover_status is not self.DISCOVERED
+        self._check_not_frozen()
         if self.is_registered(element, *args, **kwargs):
             if not self.ignore_duplicates:
                 raise AlreadyRegistered(u"%s already registered in %s _registry" % (
@@ -98,6 +441,73 @@ class BaseRegistry(Sized, Iterable, Container):
     def unregister(self, element):
         raise NotImplementedError
 
+    def _check_not_frozen(self):
+        if self.frozen:
+            raise RegistryFrozen(u"%s is frozen" % self.__class__.__name__)
+
+    def freeze(self):
+        """Makes the registry read-only : registering or unregistering will raise :exc:`RegistryFrozen`.
+        
+        The registry is discovered first (if `autoload` is set).
+        """
+        self._discover()
+        with self._locked():
+            if self.frozen:
+                return
+            self._registry = self.freeze_registry(self._registry)
+            self.frozen = True
+            if self._discover_status is self.DISCOVERED:
+                self._bind_accessors()
+
+    def freeze_registry(self, registry):
+        """Returns a read-only copy of the `registry` datastructure"""
+        raise NotImplementedError
+
+    @discover
+    def snapshot(self):
+        """Returns a :class:`RegistrySnapshot` of the current content.
+        
+        The snapshot is cached until the registry :attr:`version` changes.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != self.version:
+            snapshot = self._snapshot = RegistrySnapshot(self, self.freeze_registry(self._registry))
+        return snapshot
+
+    @discover
+    def by(self, index_name, key):
+        """Returns the list of elements indexed under `key` by the `index_name` index"""
+        try:
+            buckets = self._indexes[index_name]
+        except KeyError:
+            raise KeyError(u"%s has no '%s' index" % (self.__class__.__name__, index_name))
+        return self._get_elements(buckets.get(key, ()))
+
+    def _get_elements(self, entries):
+        """Returns the elements corresponding to index entries"""
+        return list(entries)
+
+    def _resolve_all(self):
+        """Imports the lazily registered elements"""
+        pass
+
+    def _index(self, element, entry):
+        """Adds `entry` (the element or its key) to the indexes, under the `element` keys"""
+        for index in self.indexes:
+            buckets = self._indexes[index.name]
+            for key in index.keys(element):
+                buckets.setdefault(key, set()).add(entry)
+
+    def _unindex(self, element, entry):
+        for index in self.indexes:
+            buckets = self._indexes[index.name]
+            for key in index.keys(element):
+                bucket = buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(entry)
+                    if not bucket:
+                        del buckets[key]
+
     
 class Registry(BaseRegistry):
     
@@ -105,47 +515,97 @@ class Registry(BaseRegistry):
     
     def add(self, element):
         self._registry.add(element)
+        self._index(element, element)
+        self.version += 1
     
     def unregister(self, element):
+        self._check_not_frozen()
         self._registry.remove(element)
+        self._unindex(element, element)
+        self.version += 1
+    
+    def freeze_registry(self, registry):
+        return frozenset(registry)
         
 class DictRegistry(Mapping, BaseRegistry):
     
     registry_class = dict
     
-    @discover
+    def __init__(self):
+        super(DictRegistry, self).__init__()
+        #: :class:`LazyElement` instances registered with `register_lazy` and not imported yet, by key.
+        #: They are kept apart so that reading resolved elements costs a single dict lookup.
+        self._lazy = {}
+    
     def __getitem__(self, key):
-        return self._registry[key]
+        if self._discover_status is not self.DISCOVERED:
+            self._discover()
+        try:
+            return self._registry[key]
+        except KeyError:
+            lazy = self._lazy.get(key)
+            if lazy is None:
+                raise
+            return self._resolve(key, lazy)
+    
+    def __iter__(self):
+        if self._discover_status is not self.DISCOVERED:
+            self._discover()
+        if self._lazy:
+            return iter(self._registry.keys() + self._lazy.keys())
+        return iter(self._registry)
+    
+    def __len__(self):
+        if self._discover_status is not self.DISCOVERED:
+            self._discover()
+        return len(self._registry) + len(self._lazy)
+    
+    def __contains__(self, key):
+        if self._discover_status is not self.DISCOVERED:
+            self._discover()
+        return key in self._registry or key in self._lazy
     
+    def _count(self):
+        return len(self._registry) + len(self._lazy)
+    
+    @discover
     def keys(self):
-        return self._registry.keys()
+        return self._registry.keys() + self._lazy.keys()
     
     @discover
     def items(self):
+        self._resolve_all()
         return self._registry.items()
     
     @discover
     def iteritems(self):
+        self._resolve_all()
         for item in self._registry.iteritems():
             yield item
     
     @discover
     def values(self):
+        self._resolve_all()
         return self._registry.values()
     
     @discover
     def itervalues(self):
+        self._resolve_all()
         for v in self._registry.itervalues():
             yield v
     
-    def get(self, key, default):
-        return self._registry.get(key, default)
+    @discover
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
     
     def __eq__(self, other):
-        return isinstance(other, DictRegistry) and other._registry == self._registry
+        return isinstance(other, DictRegistry) and other._registry == self._registry and other._lazy == self._lazy
         
     def __ne__(self, other):
-        return not isinstance(other, DictRegistry) or other._registry != self._registry    
+        return not self == other
         
     def register(self, element, key=None):
         if key is None:
@@ -155,19 +615,90 @@ class DictRegistry(Mapping, BaseRegistry):
                 raise ImproperlyConfigured(u"%s _registry : provide a key or implement get_key()")
         return super(DictRegistry, self).register(element, key)
     
+    def register_lazy(self, key, path):
+        """Registers the element at the dotted `path` without importing it.
+        
+        The element will be imported (and validated) on first access.
+        """
+        assert self._discover_status is not self.DISCOVERED
+        self._check_not_frozen()
+        if self.is_registered(None, key):
+            if not self.ignore_duplicates:
+                raise AlreadyRegistered(u"%s already registered in %s _registry" % (
+                                        key, self.__class__.__name__))
+        else:
+            self.add(LazyElement(path), key)
+    
+    def _resolve(self, key, lazy):
+        """Imports a lazy element and moves it to the registry"""
+        with self._locked():
+            # Another thread may have resolved it
+            if key in self._registry:
+                return self._registry[key]
+            element = import_by_path(lazy.path)
+            self.validate(element, key)
+            # The registry may be a FrozenDict
+            dict.__setitem__(self._registry, key, element)
+            self._index(element, key)
+            del self._lazy[key]
+            if not self._lazy and self._discover_status is self.DISCOVERED:
+                self._bind_accessors()
+        return element
+    
+    @discover
+    def by(self, index_name, key):
+        # Lazy elements can't be indexed until imported
+        self._resolve_all()
+        return super(DictRegistry, self).by(index_name, key)
+    
+    def _get_elements(self, keys):
+        return [self._registry[key] for key in keys]
+    
+    def _resolve_all(self):
+        for key, lazy in self._lazy.items():
+            self._resolve(key, lazy)
+    
     def get_key(self, element):
         raise NotImplementedError
     
+    def _bind_accessors(self):
+        # Lazy elements must be resolved by our own accessors
+        if self._lazy:
+            return
+        r = self._registry
+        self.keys = r.keys
+        self.items = r.items
+        self.iteritems = r.iteritems
+        self.values = r.values
+        self.itervalues = r.itervalues
+        self.get = r.get
+    
     def is_registered(self, element, key):
-#        r = self._registry
-        i = key in self._registry
-        return i
+        return key in self._registry or key in self._lazy
         
     def add(self, element, key):
-        self._registry[key] = element
+        if element.__class__ is LazyElement:
+            self._lazy[key] = element
+        else:
+            self._registry[key] = element
+            self._index(element, key)
+        self.version += 1
         
     def unregister(self, key):
-        del self._registry[key]
+        self._check_not_frozen()
+        if key in self._lazy:
+            del self._lazy[key]
+        else:
+            self._unindex(self._registry.pop(key), key)
+        self.version += 1
+    
+    def freeze_registry(self, registry):
+        return FrozenDict(registry)
+    
+    @discover
+    def snapshot(self):
+        self._resolve_all()
+        return super(DictRegistry, self).snapshot()
         
         
     
@@ -0,0 +1,23 @@
+(function($) {
+    $(document).ready(function() {
+    	
+    	$('a.jsonLoad').click(function(event){
+    		/* Replace the truncated preview with the full document */
+    		var $link = $(this);
+    		var $unchanged = $link.prev('input[type=hidden]');
+    		var $textarea = $unchanged.prev('textarea');
+    		$link.text('...');
+    		$.ajax({
+    			url: $link.attr('href'),
+    			dataType: 'text',
+    			success: function(data) {
+    				$textarea.val(data).removeAttr('disabled').attr('name', $textarea.attr('data-name'));
+    				$unchanged.remove();
+    				$link.remove();
+    			}
+    		});
+    		return false;
+    	});
+    	
+	});
+})(django.jQuery)
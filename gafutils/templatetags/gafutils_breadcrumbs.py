@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Breadcrumbs template tags."""
+
+from django import template
+from gafutils.views.breadcrumbs import get_request_breadcrumbs, render_cached
+
+register = template.Library()
+
+@register.simple_tag(takes_context=True)
+def url_breadcrumbs(context, sep=' > '):
+    """Renders the breadcrumbs of the current request, built from the urlconf.
+    
+    Needs the ``request`` in the context::
+    
+        {% load gafutils_breadcrumbs %}
+        {% url_breadcrumbs " / " %}
+    """
+    request = context.get('request')
+    if request is None:
+        return u''
+    return get_request_breadcrumbs(request).render(sep)
+
+@register.simple_tag(takes_context=True)
+def breadcrumbs(context, trail=None, sep=' > ', key=None):
+    """Renders a :class:`~gafutils.views.breadcrumbs.Breadcrumbs` instance through the cache.
+    
+    The trail defaults to the ``breadcrumbs`` context variable. A cheap `key` identifying
+    the trail (see :func:`~gafutils.views.breadcrumbs.get_cache_key`) avoids hashing its crumbs::
+    
+        {% load gafutils_breadcrumbs %}
+        {% breadcrumbs %}
+        {% breadcrumbs url_breadcrumbs " / " %}
+        {% breadcrumbs breadcrumbs " > " request.path %}
+    """
+    if trail is None:
+        trail = context.get('breadcrumbs')
+    if not trail:
+        return u''
+    return render_cached(trail, sep, key=key)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Test helpers."""
+
+from gafutils.instrumentation import collect, measure
+
+ALL_QUERIES = '*'
+
+class _AssertMaxQueriesContext(object):
+    
+    def __init__(self, test_case, maximum, component):
+        self.test_case = test_case
+        self.maximum = maximum
+        self.component = component
+        
+    def __enter__(self):
+        self.collect = collect()
+        self.stats = self.collect.__enter__()
+        self.measure = measure(ALL_QUERIES)
+        self.measure.__enter__()
+        return self.stats
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        self.measure.__exit__(exc_type, exc_value, tb)
+        self.collect.__exit__(exc_type, exc_value, tb)
+        if exc_type is not None:
+            return False
+        queries = self.stats.queries(self.component)
+        self.test_case.assertTrue(queries <= self.maximum,
+            u"%d queries executed by %s, %d expected at most" % (queries, self.component, self.maximum))
+        return False
+
+class QueriesTestMixin(object):
+    """:class:`~django.test.TestCase` mixin providing query count assertions
+    that, unlike ``assertNumQueries``, accept any count up to a maximum
+    and can be restricted to a gafutils component (see :mod:`gafutils.instrumentation`)."""
+    
+    def assertMaxQueries(self, maximum, func=None, *args, **kwargs):
+        """Asserts that `func` (or the block, if used as a context manager) executes at most `maximum` queries."""
+        return self.assertMaxComponentQueries(ALL_QUERIES, maximum, func, *args, **kwargs)
+    
+    def assertMaxComponentQueries(self, component, maximum, func=None, *args, **kwargs):
+        """Asserts that `component` executes at most `maximum` queries while calling `func` (or in the block)."""
+        context = _AssertMaxQueriesContext(self, maximum, component)
+        if func is None:
+            return context
+        with context:
+            func(*args, **kwargs)
@@ -2,6 +2,7 @@
 from django.db import models
 from gafutils.db.fields import DefaultObjectField
 from gafutils.db.fields import dynamic_type
+from gafutils.db.polymorphism import PolymorphicModel
 
 
 
@@ -38,6 +39,19 @@ class ValueHolder(models.Model):
     
 class IntValueHolder(ValueHolder):
     value_type = 'int'
+
+class TypedValueHolder(models.Model):
+    
+    value_type = models.CharField(max_length=10)
+    value = dynamic_type.DynamicTypeField()
+
+class ExtendedValueHolder(models.Model):
+    
+    value_type = models.CharField(max_length=10)
+    value = dynamic_type.DynamicTypeField(types=[
+        dynamic_type.BIGINT, dynamic_type.DECIMAL,
+        dynamic_type.DATE, dynamic_type.DATETIME,
+    ])
     
 class FieldMapValueHolder(models.Model):
     
@@ -51,4 +65,19 @@ class FieldMapValueHolder(models.Model):
     
     
     
-    
\ No newline at end of file
+    
+
+# Test models for : PolymorphicModel
+# -----------------------------------------------------------------------------
+
+class Animal(PolymorphicModel):
+    name = models.CharField(max_length=40)
+
+class Dog(Animal):
+    barks = models.BooleanField(default=True)
+
+class Cat(Animal):
+    lives = models.IntegerField(default=9)
+
+class Bird(Animal):
+    wingspan = models.FloatField(default=0)
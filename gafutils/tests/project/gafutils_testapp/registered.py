@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from gafutils.tests.project.gafutils_testapp.registries import handlers
+
+
+class Handler(object):
+    content_type = None
+
+class ImageHandler(Handler):
+    content_type = 'image'
+
+class TextHandler(Handler):
+    content_type = 'text'
+
+handlers.register(ImageHandler, 'image')
+handlers.register(TextHandler, 'text')
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from gafutils.registry import DictRegistry, AttributeIndex, SubclassIndex
+
+
+# Test registries, filled by the `registered` modules
+# -----------------------------------------------------------------------------
+
+class HandlerRegistry(DictRegistry):
+    discover_module = 'registered'
+    indexes = (
+        AttributeIndex('content_type'),
+        SubclassIndex(),
+    )
+
+handlers = HandlerRegistry()
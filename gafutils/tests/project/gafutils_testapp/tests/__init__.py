@@ -1,7 +1,15 @@
 from .db.fields import *
+from .db.polymorphism import *
+from .registry import *
+from .commands import *
+from .daemon import *
 #from gafutils.db.fields import default_object, dynamic_type
 
 #__test__ = {
 #    'default_object_field': default_object,
 #    'dynamic_type': dynamic_type,
-#}
\ No newline at end of file
+#}
+from .instrumentation import *
+from .benchmarks import *
+from .forms import *
+from .views import *
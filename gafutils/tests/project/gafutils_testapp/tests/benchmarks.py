@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from StringIO import StringIO
+from django.db import connections
+from django.test import TestCase
+from gafutils import instrumentation
+from gafutils.benchmarks import scenarios
+from gafutils.management.commands.gafutils_benchmark import Command
+from gafutils.tests.project.gafutils_testapp.models import Animal, Picture
+from gafutils.tests.project.gafutils_testapp.tests.commands import run_command
+
+
+class InstrumentedScenario(scenarios.Scenario):
+    number = 2
+    
+    def setup(self):
+        self.instrumented = []
+    
+    def run(self):
+        self.instrumented.append(instrumentation.measure('foo') is not instrumentation._noop)
+        Picture.objects.count()
+
+
+class BenchmarkTest(TestCase):
+    
+    def test_run(self):
+        results = scenarios.run(repeat=1)
+        self.assertEqual(set(s.name for s in scenarios.SCENARIOS), set(results))
+        self.assertTrue(results['polymorphism.iter']['queries'] >= 3)
+        self.assertEqual(0, results['dynamic_type.access']['queries'])
+        self.assertEqual(0, Animal.objects.count())
+        self.assertEqual(0, Picture.objects.count())
+        
+    def test_untimed_instrumentation(self):
+        scenario = InstrumentedScenario()
+        instrumentation.set_sink(instrumentation.StatsSink())
+        try:
+            result = scenario.measure(repeat=2)
+        finally:
+            instrumentation.set_sink(None)
+        # 2 timing loops of 2 runs, then a counted run
+        self.assertEqual([False] * 4 + [True], scenario.instrumented)
+        self.assertEqual(1, result['queries'])
+    
+    def test_non_sqlite(self):
+        connections['default'].vendor = 'postgresql'
+        try:
+            stderr = StringIO()
+            self.assertRaises(SystemExit, run_command, Command(), stderr=stderr)
+            self.assertIn('--allow-non-sqlite', stderr.getvalue())
+        finally:
+            del connections['default'].vendor
+        
+    def test_compare(self):
+        baseline = {'a': {'time': 1.0, 'queries': 2}, 'b': {'time': 1.0, 'queries': 2}}
+        results = {'a': {'time': 1.1, 'queries': 2}, 'b': {'time': 1.5, 'queries': 2}, 'c': {'time': 1, 'queries': 0}}
+        comparison = scenarios.compare(results, baseline, threshold=0.2)
+        self.assertEqual([('a', False), ('b', True), ('c', False)], [(c[0], c[3]) for c in comparison])
+        results['a']['queries'] = 3
+        self.assertTrue(scenarios.compare(results, baseline)[0][3])
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+from StringIO import StringIO
+from optparse import NO_DEFAULT
+import Queue
+import logging
+import os
+import tempfile
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+from gafutils.commands import ExtendedBaseCommand, ParallelCommand, SudoCommand, Step, QueueHandler, QueueListener
+from gafutils.tests.project.gafutils_testapp.models import Picture
+
+
+def run_command(command, *args, **options):
+    """Executes a command instance with its default options"""
+    defaults = dict((o.dest, o.default) for o in command.option_list
+                    if o.dest and o.default is not NO_DEFAULT)
+    defaults['stderr'] = StringIO()
+    defaults.update(options)
+    return command.execute(*args, **defaults)
+
+class SumCommand(ParallelCommand):
+    logger_name = 'gafutils.tests.cmd'
+    
+    def __init__(self, failures=0):
+        super(SumCommand, self).__init__()
+        self.failures = failures
+    
+    def get_chunks(self, *args, **options):
+        return [xrange(i, i + 10) for i in range(0, 100, 10)]
+    
+    def process_chunk(self, chunk, *args, **options):
+        if self.failures:
+            self.failures -= 1
+            raise ValueError
+        return sum(chunk)
+    
+    def aggregate(self, results):
+        self.total = sum(results)
+
+
+class QueryErrorCommand(SumCommand):
+    
+    def process_chunk(self, chunk, *args, **options):
+        if self.failures:
+            self.failures -= 1
+            connection.cursor().execute("SELECT * FROM no_such_table")
+        return Picture.objects.filter(pk__in=list(chunk)).count()
+
+
+class LoggingSumCommand(SumCommand):
+    logger_name = 'gafutils.tests.cmd.parallel'
+    
+    def process_chunk(self, chunk, *args, **options):
+        self.logger.info(u"chunk %d", chunk[0])
+        return sum(chunk)
+
+
+class ParallelCommandTest(TestCase):
+    
+    def test_workers(self):
+        command = SumCommand()
+        run_command(command, workers=2)
+        self.assertEqual(sum(range(100)), command.total)
+    
+    def test_retries(self):
+        command = SumCommand(failures=3)
+        run_command(command, workers=1, retries=2)
+        self.assertEqual(sum(range(100)), command.total)
+        command = SumCommand(failures=20)
+        self.assertRaises(SystemExit, run_command, command, workers=1, retries=1)
+    
+    def test_query_error(self):
+        command = QueryErrorCommand(failures=2)
+        run_command(command, workers=1, retries=1)
+        self.assertEqual(0, command.total)
+    
+    def test_async_log_workers(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        logger = logging.getLogger(LoggingSumCommand.logger_name)
+        handler = logging.FileHandler(path)
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        try:
+            run_command(LoggingSumCommand(), workers=2, async_log=True)
+            handler.close()
+            with open(path) as f:
+                lines = f.read().splitlines()
+            # Logged by the workers
+            self.assertTrue(set("chunk %d" % i for i in range(0, 100, 10)) <= set(lines), lines)
+        finally:
+            logger.removeHandler(handler)
+            os.remove(path)
+
+
+class LogCommand(ExtendedBaseCommand):
+    logger_name = 'gafutils.tests.cmd.log'
+    
+    def do_handle(self, *args, **options):
+        for i in range(100):
+            self.logger.debug(u"row %d", i)
+        self.logger.info(u"done")
+
+
+class LoggingTest(TestCase):
+    
+    def setUp(self):
+        self.messages = []
+        self.handler = logging.Handler()
+        self.handler.emit = lambda record: self.messages.append(record.getMessage())
+        self.logger = logging.getLogger(LogCommand.logger_name)
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+    
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+    
+    def test_sampling(self):
+        run_command(LogCommand(), log_sample=10)
+        self.assertEqual([u"row %d" % i for i in range(0, 100, 10)] + [u"done"], self.messages)
+        self.assertEqual([], self.logger.filters)
+    
+    def test_rate_limit(self):
+        run_command(LogCommand(), log_rate=5)
+        self.assertTrue(len(self.messages) <= 11)
+        self.assertEqual(u"done", self.messages[-1])
+    
+    def test_async(self):
+        run_command(LogCommand(), async_log=True)
+        self.assertEqual(101, len(self.messages))
+        self.assertEqual([self.handler], self.logger.handlers)
+    
+    def test_queue_listener(self):
+        queue = Queue.Queue()
+        self.handler.setLevel(logging.INFO)
+        listener = QueueListener(queue, self.handler)
+        listener.start()
+        logger = logging.getLogger('gafutils.tests.cmd.queue')
+        logger.propagate = False
+        logger.addHandler(QueueHandler(queue))
+        try:
+            logger.debug(u"hidden")
+            try:
+                1 / 0
+            except ZeroDivisionError:
+                logger.exception(u"failed %d", 1)
+        finally:
+            listener.stop()
+            logger.handlers = []
+        self.assertEqual(1, len(self.messages))
+        self.assertTrue(self.messages[0].startswith(u"failed 1\nTraceback"), self.messages[0])
+
+
+class PhaseCommand(ExtendedBaseCommand):
+    logger_name = 'gafutils.tests.cmd.phase'
+    
+    def do_handle(self, *args, **options):
+        with self.phase('build'):
+            self.data = [str(i) for i in range(10000)]
+
+
+class ProfilingTest(TestCase):
+    
+    def run_profiled(self, **options):
+        command = PhaseCommand()
+        stderr = StringIO()
+        run_command(command, stderr=stderr, **options)
+        return stderr.getvalue()
+    
+    def test_profile(self):
+        report = self.run_profiled(profile=True, profile_top=5)
+        self.assertIn("function calls", report)
+        self.assertIn("do_handle", report)
+    
+    def test_profile_file(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            report = self.run_profiled(profile_file=path)
+            self.assertIn("function calls", report)
+            self.assertTrue(os.path.getsize(path) > 0)
+        finally:
+            os.remove(path)
+    
+    def test_timing(self):
+        lines = self.run_profiled(timing=True).splitlines()
+        self.assertTrue(lines[0].startswith("phase"))
+        self.assertEqual(['init_logging', 'do_handle', 'build'], [line.split()[0] for line in lines[1:]])
+    
+    def test_mem(self):
+        report = self.run_profiled(mem=True)
+        self.assertTrue(report.startswith("Memory: "), report)
+        self.assertNotIn("phase", report)
+
+
+class CheckpointTest(TestCase):
+    
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.path)
+        self.command = ExtendedBaseCommand()
+        self.command.logger = logging.getLogger('gafutils.tests.cmd')
+        self.command.options = {'checkpoint_file': self.path, 'resume': False}
+    
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def test_resume(self):
+        pks = [Picture.objects.create(name=str(i)).pk for i in range(5)]
+        it = self.command.iter_checkpointed(Picture.objects.all(), chunk_size=2)
+        self.assertEqual(pks[:3], [next(it).pk for i in range(3)])
+        # Interrupted in the second chunk : the first one is checkpointed
+        self.assertEqual(pks[1], self.command.read_checkpoint(self.path))
+        self.command.options['resume'] = True
+        resumed = [obj.pk for obj in self.command.iter_checkpointed(Picture.objects.all(), chunk_size=2)]
+        self.assertEqual(pks[2:], resumed)
+        self.assertFalse(os.path.exists(self.path))
+
+
+class StepsTest(TestCase):
+    
+    def setUp(self):
+        self.command = SudoCommand()
+        self.command.stdout = StringIO()
+        self.command.options = {'jobs': 4, 'dry_run': False}
+        self.lines = []
+        handler = logging.Handler()
+        handler.emit = lambda record: self.lines.append(record.getMessage())
+        self.command.logger = logging.getLogger('gafutils.tests.steps')
+        self.command.logger.addHandler(handler)
+        self.command.logger.setLevel(logging.INFO)
+    
+    def test_run_steps(self):
+        self.command.run_steps({
+            'a': 'echo a',
+            'b': Step('echo b', requires=['a']),
+            'c': Step(['echo', 'c d']),
+        })
+        self.assertIn(u'[c] c d', self.lines)
+        self.assertLess(self.lines.index(u'[a] a'), self.lines.index(u'[b] echo b'))
+    
+    def test_non_ascii(self):
+        self.command.run_steps({'a': Step(['printf', '\xc3\xa9t\xc3\xa9\n\xff\n'])})
+        self.assertIn(u'[a] printf \xe9t\xe9\n\ufffd\n', self.lines)
+        self.assertIn(u'[a] \xe9t\xe9', self.lines)
+        self.assertIn(u'[a] \ufffd', self.lines)
+    
+    def test_failures(self):
+        self.assertRaises(CommandError, self.command.run_steps, {
+            'a': 'false',
+            'b': Step('echo b', requires=['a']),
+            'c': Step('echo c', requires=['b']),
+            'd': Step('sleep 5', timeout=0.1),
+        })
+        self.assertIn(u'[c] skipped', self.lines)
+        self.assertIn(u'[d] timed out after 0.1s', self.lines)
+        self.assertNotIn(u'[b] b', self.lines)
+    
+    def test_dry_run(self):
+        self.command.run_steps({'a': 'echo a', 'b': Step('echo b', requires=['a'])}, dry_run=True)
+        self.assertEqual(u"1. a: echo a\n2. b: echo b (after a)\n", self.command.stdout.getvalue())
+        self.assertRaises(CommandError, self.command.run_steps, {'a': Step('true', requires=['a'])})
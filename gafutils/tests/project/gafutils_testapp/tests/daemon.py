@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from StringIO import StringIO
+import os
+import socket
+import tempfile
+import threading
+import time
+from django.test import TestCase
+from gafutils.daemon import CommandServer, run_command
+
+
+class CommandServerTest(TestCase):
+    
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'run', 'daemon.sock')
+        self.server = CommandServer(self.path)
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.start()
+        while not os.path.exists(self.path):
+            time.sleep(0.01)
+    
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        os.rmdir(os.path.dirname(self.path))
+        os.rmdir(os.path.dirname(os.path.dirname(self.path)))
+    
+    def test_run_command(self):
+        stdout, stderr = StringIO(), StringIO()
+        self.assertEqual(0, run_command(['help', 'registry_stats'], self.path, stdout, stderr))
+        self.assertIn('--sort', stdout.getvalue())
+        self.assertEqual(1, run_command(['not_a_command'], self.path, stdout, stderr))
+        self.assertIn('Unknown command', stderr.getvalue())
+    
+    def test_socket_directory(self):
+        self.assertEqual(0700, os.stat(os.path.dirname(self.path)).st_mode & 0777)
+    
+    def test_foreign_socket(self):
+        if os.getuid() != 0:
+            self.skipTest(u"changing the socket owner needs root")
+        os.chown(self.path, 65534, -1)
+        self.assertRaises(socket.error, run_command, ['help'], self.path, StringIO(), StringIO())
@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
+import datetime
+from decimal import Decimal
 from django.conf import settings
-from django.core.exceptions import SuspiciousOperation
+from django.core.exceptions import ImproperlyConfigured, SuspiciousOperation
 from django.test import TestCase
+from django.utils import unittest
 from gafutils.tests.project.gafutils_testapp.models import Picture, TinyPicture, IntValueHolder, \
-    ValueHolder, FieldMapValueHolder
+    ValueHolder, FieldMapValueHolder, TypedValueHolder, ExtendedValueHolder
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class DynamicTypeFieldTest(TestCase):
@@ -20,6 +28,58 @@ class DynamicTypeFieldTest(TestCase):
         """Tests that the `field_map` argument is correctly handled"""
 #        vh = FieldMapValueHolder()
         self.assertEqual(['i_value', 'b_value'], FieldMapValueHolder.value.get_field_names())
+    
+    def test_metadata(self):
+        field = FieldMapValueHolder.value
+        self.assertEqual(('i_value', 'b_value'), field.field_names)
+        self.assertEqual({'i_value': 'int', 'b_value': 'bool'}, field.column_types)
+        self.assertEqual(['i_value', 'b_value'], [f.name for f in field.get_fields()])
+        obj = IntValueHolder()
+        self.assertIs(ValueHolder.value.get_field(obj), ValueHolder._meta.get_field('value_int'))
+    
+    def test_default_types(self):
+        self.assertEqual(set(['value_bool', 'value_str', 'value_int', 'value_float']),
+                         set(ValueHolder.value.get_field_names()))
+    
+    def test_extended_types(self):
+        obj = ExtendedValueHolder(value_type='date')
+        obj.value = '2013-04-01'
+        self.assertEqual(obj.value, datetime.date(2013, 4, 1))
+        obj.value_type = 'decimal'
+        obj.value = '1.5'
+        obj.value_type = 'bigint'
+        obj.value = '12345678901'
+        obj.save()
+        obj = ExtendedValueHolder.objects.get(pk=obj.pk)
+        self.assertEqual(obj.value, 12345678901)
+        self.assertEqual(obj.value_decimal, Decimal('1.5'))
+        self.assertEqual(obj.value_date, datetime.date(2013, 4, 1))
+    
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_to_arrays(self):
+        TypedValueHolder.objects.create(value_type='int', value_int=1)
+        TypedValueHolder.objects.create(value_type='int')
+        TypedValueHolder.objects.create(value_type='str', value_str='abc')
+        TypedValueHolder.objects.create(value_type='int', value_int=3)
+        arrays = TypedValueHolder.value.to_arrays(TypedValueHolder.objects.all(), chunk_size=2)
+        pks, values = arrays['int']
+        self.assertEqual(values.dtype, numpy.int64)
+        self.assertEqual(list(values.mask), [False, True, False])
+        self.assertEqual(values.sum(), 4)
+        self.assertEqual(len(pks), 3)
+        self.assertEqual(list(arrays['str'][1]), ['abc'])
+        self.assertEqual(len(arrays['float'][0]), 0)
+        self.assertEqual(arrays['float'][0].dtype, numpy.int64)
+    
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_to_arrays_constant_type(self):
+        obj = IntValueHolder()
+        obj.value = 5
+        obj.save()
+        arrays = IntValueHolder.value.to_arrays(IntValueHolder.objects.all())
+        self.assertEqual(['int'], arrays.keys())
+        self.assertEqual([5], list(arrays['int'][1]))
+        self.assertRaises(ImproperlyConfigured, ValueHolder.value.to_arrays, ValueHolder.objects.all())
         
         
     
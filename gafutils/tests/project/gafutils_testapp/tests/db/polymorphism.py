@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import json
+from django.db import router
+from django.db.models.signals import pre_delete
+from django.test import TestCase
+from gafutils.db.polymorphism import iter_polymorphic_json
+from gafutils.testing import QueriesTestMixin
+from gafutils.tests.project.gafutils_testapp.models import Animal, Dog, Cat, Bird
+
+
+class ReplicaRouter(object):
+    """Reads the test app models from an unknown database, that would fail any read"""
+    
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'gafutils_testapp':
+            return 'replica'
+        return None
+    
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+
+class PolymorphismTest(QueriesTestMixin, TestCase):
+    
+    def setUp(self):
+        for i in range(5):
+            Dog.objects.create(name='dog%d' % i)
+            Cat.objects.create(name='cat%d' % i)
+            Bird.objects.create(name='bird%d' % i)
+    
+    def test_select_polymorphic(self):
+        animals = list(Animal.objects.select_polymorphic().order_by('pk')[:3])
+        self.assertEqual([Dog, Cat, Bird], [type(a) for a in animals])
+        self.assertEqual(animals[1], Animal.objects.get(pk=animals[1].pk).cast())
+        
+    def test_fast_delete(self):
+        qs = Animal.objects.exclude(name__in=['dog0', 'cat0'])
+        # 1 select, 3 children tables and the base table, content types being cached
+        with self.assertMaxQueries(5):
+            self.assertEqual(13, qs.fast_delete())
+        self.assertEqual(['cat0', 'dog0'], sorted(Animal.objects.values_list('name', flat=True)))
+        self.assertEqual(1, Dog.objects.count())
+        self.assertEqual(1, Cat.objects.count())
+        self.assertEqual(0, Bird.objects.count())
+        self.assertTrue(qs.fast_delete.alters_data)
+    
+    def test_fast_delete_write_database(self):
+        routers = router.routers
+        router.routers = [ReplicaRouter()]
+        try:
+            self.assertEqual(15, Animal.objects.all().fast_delete())
+        finally:
+            router.routers = routers
+        self.assertEqual(0, Animal.objects.count())
+        
+    def test_fast_delete_fallback(self):
+        deleted = []
+        def receiver(sender, instance, **kwargs):
+            deleted.append(instance.name)
+        pre_delete.connect(receiver, sender=Dog)
+        try:
+            self.assertEqual(15, Animal.objects.all().fast_delete())
+        finally:
+            pre_delete.disconnect(receiver, sender=Dog)
+        self.assertEqual(5, len(deleted))
+        self.assertEqual(0, Animal.objects.count())
+        self.assertEqual(0, Dog.objects.count())
+        
+    def test_iter_json(self):
+        qs = Animal.objects.filter(name__endswith='1').order_by('-pk')
+        data = json.loads(''.join(qs.iter_json(chunk_size=2)))
+        self.assertEqual([a.pk for a in qs], [d['pk'] for d in data])
+        self.assertEqual(['gafutils_testapp.bird', 'gafutils_testapp.cat', 'gafutils_testapp.dog'],
+                         [d['model'] for d in data])
+        self.assertEqual({'name': 'bird1', 'wingspan': 0}, data[0]['fields'])
+        self.assertEqual({'name': 'dog1', 'barks': True}, data[2]['fields'])
+        data = json.loads(''.join(iter_polymorphic_json(qs, fields=['lives'])))
+        self.assertEqual([{}, {'lives': 9}, {}], [d['fields'] for d in data])
+        self.assertEqual('[]', ''.join(Animal.objects.filter(name='nobody').iter_json()))
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import json
+from django import forms
+from django.contrib.auth.models import Permission, User
+from django.http import Http404
+from django.test import TestCase
+from django.test.client import RequestFactory
+from gafutils.forms.widgets import JsonTextAreaWidget, JsonTextAreaFormMixin
+from gafutils.tests.project.gafutils_testapp.models import Picture
+from gafutils.views.widgets import json_value
+
+
+class PictureForm(JsonTextAreaFormMixin, forms.ModelForm):
+
+    class Meta:
+        model = Picture
+        fields = ('name',)
+        widgets = {'name': JsonTextAreaWidget(max_size=5)}
+
+
+class JsonTextAreaWidgetTest(TestCase):
+    urls = 'gafutils.tests.project.gafutils_testapp.urls'
+
+    value = {'items': range(100)}
+
+    def test_render(self):
+        html = JsonTextAreaWidget(indent=2).render('data', {'a': 1})
+        self.assertTrue('{\n  &quot;a&quot;: 1\n}' in html, html)
+        html = JsonTextAreaWidget(compact=True).render('data', {'a': [1, 2]})
+        self.assertTrue('{&quot;a&quot;:[1,2]}' in html, html)
+        self.assertTrue('>null</textarea>' in JsonTextAreaWidget().render('data', None))
+        # Unbound widgets can't load the full value : they are never truncated
+        html = JsonTextAreaWidget(max_size=50).render('data', self.value)
+        self.assertEqual(self.value, json.loads(html.split('>', 1)[1].split('<')[0].replace('&quot;', '"')))
+        self.assertFalse('data_json_unchanged' in html)
+
+    def test_truncated(self):
+        picture = Picture.objects.create(name='a long name')
+        html = PictureForm(instance=picture).as_p()
+        self.assertTrue('disabled="disabled"' in html, html)
+        self.assertFalse(' name="name"' in html, html)
+        self.assertTrue('>a lon</textarea>' in html, html)
+        self.assertTrue('href="/gafutils/json/gafutils_testapp/picture/%d/name/?indent=4"' % picture.pk in html, html)
+        # Posted without loading the full value : the object value is kept
+        form = PictureForm({'name_json_unchanged': '1'}, instance=Picture.objects.get(pk=picture.pk))
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual('a long name', form.cleaned_data['name'])
+        form = PictureForm({'name': 'edited', 'name_json_unchanged': '1'}, instance=picture)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual('edited', form.cleaned_data['name'])
+        self.assertFalse('disabled' in PictureForm().as_p())
+
+    def test_view(self):
+        picture = Picture.objects.create(name='a long name')
+        url = '/gafutils/json/gafutils_testapp/picture/%d/name/' % picture.pk
+        response = self.client.get(url)
+        self.assertEqual(302, response.status_code)
+        user = User.objects.create_user('staff', 'staff@example.com', 'staff')
+        user.is_staff = True
+        user.save()
+        self.client.login(username='staff', password='staff')
+        self.assertEqual(403, self.client.get(url).status_code)
+        user.user_permissions.add(Permission.objects.get(codename='change_picture'))
+        response = self.client.get(url)
+        self.assertEqual('a long name', response.content)
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(username='staff')
+        self.assertRaises(Http404, json_value, request, 'gafutils_testapp', 'picture', '0', 'name')
+        self.assertRaises(Http404, json_value, request, 'gafutils_testapp', 'picture', str(picture.pk), 'nope')
+        self.assertRaises(Http404, json_value, request, 'gafutils_testapp', 'nope', str(picture.pk), 'name')
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from gafutils import instrumentation
+from gafutils.instrumentation import collect, measure, InstrumentationMiddleware, StatsSink
+from gafutils.testing import QueriesTestMixin
+from gafutils.tests.project.gafutils_testapp.models import Picture
+
+
+class ListSink(StatsSink):
+    
+    def __init__(self):
+        self.measures = []
+    
+    def record(self, component, queries, duration):
+        self.measures.append((component, queries))
+
+
+class InstrumentationTest(QueriesTestMixin, TestCase):
+    
+    def tearDown(self):
+        instrumentation.set_sink(None)
+    
+    def test_noop(self):
+        self.assertTrue(measure('foo') is instrumentation._noop)
+        
+    def test_collect(self):
+        with collect() as stats:
+            Picture.objects.create(name='pic1')
+            Picture.objects.create(name='pic2')
+        calls, queries, duration = stats['default_object.pre_save']
+        self.assertEqual(2, calls)
+        self.assertEqual(2, queries)
+        self.assertEqual(2, stats.queries())
+        self.assertTrue(measure('foo') is instrumentation._noop)
+    
+    def test_nested(self):
+        with collect() as stats:
+            with measure('outer'):
+                Picture.objects.create(name='pic1')
+                Picture.objects.count()
+        self.assertEqual(1, stats.queries('default_object.pre_save'))
+        # the insert, the count and the pre_save query
+        self.assertEqual(3, stats.queries('outer'))
+        self.assertEqual(3, stats.queries())
+    
+    def test_queries_log(self):
+        queries = len(connection.queries)
+        use_debug_cursor = connection.use_debug_cursor
+        with collect() as stats:
+            with measure('foo'):
+                Picture.objects.count()
+        self.assertEqual(1, stats.queries('foo'))
+        self.assertEqual(queries, len(connection.queries))
+        self.assertEqual(use_debug_cursor, connection.use_debug_cursor)
+        self.assertFalse('cursor' in connection.__dict__)
+    
+    def test_sink(self):
+        sink = ListSink()
+        instrumentation.set_sink(sink)
+        Picture.objects.create(name='pic1')
+        self.assertEqual([('default_object.pre_save', 1)], sink.measures)
+        
+    def test_middleware(self):
+        middleware = InstrumentationMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        Picture.objects.create(name='pic1')
+        middleware.process_response(request, HttpResponse())
+        self.assertEqual(1, request.gafutils_stats.queries('default_object.pre_save'))
+        self.assertEqual([], instrumentation._collectors())
+    
+    def test_assert_max_queries(self):
+        with self.assertMaxQueries(2):
+            Picture.objects.create(name='pic1')
+        self.assertMaxComponentQueries('default_object.pre_save', 1, Picture.objects.create, name='pic2')
+        self.assertRaises(AssertionError, self.assertMaxQueries, 1, Picture.objects.create, name='pic3')
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import imp
+import json
+import os
+import tempfile
+import threading
+import time
+from django.test import TestCase
+from gafutils.registry import Registry, DictRegistry, LazyElement, RegistryFrozen, warm_all
+from gafutils.tests.project.gafutils_testapp.registries import handlers, HandlerRegistry
+
+
+class SlowRegistry(Registry):
+    discover_module = 'not_a_module'
+    
+    def __init__(self):
+        super(SlowRegistry, self).__init__()
+        self.discover_calls = 0
+    
+    def autodiscover(self):
+        with self._locked():
+            self.discover_calls += 1
+            time.sleep(0.05)
+            super(SlowRegistry, self).autodiscover()
+            
+
+class RegistryTest(TestCase):
+    
+    def test_autodiscover(self):
+        self.assertEqual(set(['image', 'text']), set(handlers.keys()))
+        self.assertEqual('image', handlers['image'].content_type)
+    
+    def test_discovery_stats(self):
+        handlers._discover()
+        stats = dict((stat['app'], stat) for stat in handlers.discovery_stats())
+        self.assertTrue(stats['gafutils_testapp']['found'])
+        self.assertEqual(2, stats['gafutils_testapp']['elements'])
+        self.assertFalse(stats['gafutils']['found'])
+    
+    def test_direct_accessors(self):
+        """Once discovered, read accessors are the underlying dict methods"""
+        handlers._discover()
+        self.assertEqual(handlers._registry.get, handlers.get)
+        self.assertEqual(handlers._registry.values, handlers.values)
+        self.assertIs(handlers['text'], handlers.get('text'))
+    
+    def test_register_lazy(self):
+        registry = HandlerRegistry()
+        registry.register_lazy('text', 'gafutils_testapp.registered.TextHandler')
+        registry.autodiscover()
+        self.assertIsInstance(registry._lazy['text'], LazyElement)
+        self.assertFalse('text' in registry._registry)
+        self.assertTrue('text' in registry)
+        self.assertEqual(1, len(registry))
+        self.assertEqual(['text'], registry.keys())
+        self.assertEqual(['text'], list(registry))
+        handler = registry['text']
+        self.assertEqual('text', handler.content_type)
+        self.assertIs(handler, registry._registry['text'])
+        self.assertEqual({}, registry._lazy)
+        self.assertEqual(registry._registry.values, registry.values)
+    
+    def test_indexes(self):
+        from gafutils_testapp.registered import Handler, ImageHandler, TextHandler
+        self.assertEqual([ImageHandler], handlers.by('content_type', 'image'))
+        self.assertEqual([], handlers.by('content_type', 'video'))
+        self.assertEqual(set([ImageHandler, TextHandler]), set(handlers.by('subclass', Handler)))
+        self.assertRaises(KeyError, handlers.by, 'name', 'image')
+    
+    def test_lazy_indexes(self):
+        registry = HandlerRegistry()
+        registry.register_lazy('text', 'gafutils_testapp.registered.TextHandler')
+        registry.autodiscover()
+        self.assertEqual(['text'], [h.content_type for h in registry.by('content_type', 'text')])
+        registry.unregister('text')
+        self.assertEqual([], registry.by('content_type', 'text'))
+    
+    def test_version_and_snapshot(self):
+        registry = HandlerRegistry()
+        registry.register_lazy('text', 'gafutils_testapp.registered.TextHandler')
+        registry.register_lazy('image', 'gafutils_testapp.registered.ImageHandler')
+        self.assertEqual(2, registry.version)
+        registry.autodiscover()
+        snapshot = registry.snapshot()
+        self.assertIs(snapshot, registry.snapshot())
+        self.assertEqual('text', snapshot['text'].content_type)
+        registry.unregister('image')
+        self.assertEqual(3, registry.version)
+        self.assertNotEqual(snapshot, registry.snapshot())
+        self.assertEqual(['text'], list(registry.snapshot()))
+    
+    def test_freeze(self):
+        registry = HandlerRegistry()
+        registry.register_lazy('text', 'gafutils_testapp.registered.TextHandler')
+        registry.autodiscover()
+        registry.freeze()
+        self.assertRaises(RegistryFrozen, registry.unregister, 'text')
+        self.assertRaises(TypeError, registry._registry.pop, 'text')
+        self.assertEqual('text', registry['text'].content_type)
+        self.assertEqual(registry._registry.get, registry.get)
+    
+    def test_warm_all(self):
+        registry = HandlerRegistry()
+        registry.register_lazy('text', 'gafutils_testapp.registered.TextHandler')
+        # Only warm the local registry, freezing shared ones would leak into other tests
+        warm_all(freeze=True, registries=[registry])
+        self.assertEqual(HandlerRegistry.DISCOVERED, registry._discover_status)
+        self.assertTrue(registry.frozen)
+        self.assertNotIsInstance(registry._registry['text'], LazyElement)
+    
+    def test_warm_all_not_autoload(self):
+        registry = HandlerRegistry()
+        registry.autoload = False
+        registry.register_lazy('text', 'gafutils_testapp.registered.TextHandler')
+        warm_all(freeze=True, registries=[registry])
+        self.assertEqual(HandlerRegistry.DISCOVERED, registry._discover_status)
+        self.assertTrue(registry.frozen)
+        self.assertEqual(['text'], registry.keys())
+    
+    def test_concurrent_discover(self):
+        registry = SlowRegistry()
+        errors = []
+        def read():
+            try:
+                list(registry)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=read) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([], errors)
+        self.assertEqual(1, registry.discover_calls)
+        self.assertEqual(Registry.DISCOVERED, registry._discover_status)
+    
+    def test_discover_while_importing(self):
+        """A thread holding the import lock (e.g. importing an urlconf) reads the registry
+        while another one discovers it"""
+        registry = HandlerRegistry()
+        importing = threading.Event()
+        errors = []
+        def import_and_read():
+            imp.acquire_lock()
+            try:
+                importing.set()
+                time.sleep(0.05)
+                len(registry)
+            except Exception, e:
+                errors.append(e)
+            finally:
+                imp.release_lock()
+        threads = [threading.Thread(target=import_and_read), threading.Thread(target=registry.__len__)]
+        for t in threads:
+            t.daemon = True
+        threads[0].start()
+        importing.wait()
+        threads[1].start()
+        for t in threads:
+            t.join(5)
+        self.assertFalse(any(t.is_alive() for t in threads), u"deadlock")
+        self.assertEqual([], errors)
+        self.assertEqual(Registry.DISCOVERED, registry._discover_status)
+    
+    def test_discovery_manifest(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            registry = HandlerRegistry()
+            registry.discovery_manifest = path
+            registry.autodiscover()
+            with open(path) as f:
+                self.assertEqual(['gafutils_testapp'], json.load(f)['registered']['apps'])
+            # The manifest is up to date : apps are not probed anymore
+            registry = HandlerRegistry()
+            registry.discovery_manifest = path
+            registry.autodiscover()
+            self.assertEqual(['gafutils_testapp'], [stat['app'] for stat in registry.discovery_stats()])
+        finally:
+            os.remove(path)
+    
+    def test_discovery_manifest_write_error(self):
+        registry = HandlerRegistry()
+        registry.discovery_manifest = os.path.join(tempfile.gettempdir(), 'no_such_dir', 'manifest.json')
+        registry.autodiscover()
+        self.assertEqual(Registry.DISCOVERED, registry._discover_status)
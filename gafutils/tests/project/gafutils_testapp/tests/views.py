@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+from django.core.cache import cache
+from django.template import Template, Context
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import translation
+from gafutils.context_processors import breadcrumbs
+from gafutils.views.breadcrumbs import Breadcrumb, Breadcrumbs, BreadcrumbsTrie, home_breadcrumbs, invalidate_cache, \
+    render_cached
+
+
+class BreadcrumbsTest(TestCase):
+    
+    def test_render(self):
+        bs = Breadcrumbs([Breadcrumb('home', '/'), Breadcrumb('page')])
+        self.assertEqual(2, len(bs))
+        self.assertEqual(u'<a href="/">Home</a> > Page', bs.render())
+        self.assertEqual(u'<a href="/">Home</a> / Page', bs.render(sep=' / '))
+        self.assertEqual(u'', Breadcrumbs().render())
+        
+    def test_grow_shares_parent(self):
+        section = home_breadcrumbs.grow(Breadcrumb('section', '/section/'))
+        page = section.grow(Breadcrumb('page'))
+        self.assertTrue(page.parent is section)
+        self.assertTrue(section.parent is home_breadcrumbs)
+        self.assertEqual(1, len(home_breadcrumbs))
+        self.assertEqual(3, len(page))
+        self.assertEqual(['/', '/section/', None], [b.url for b in page])
+        self.assertEqual(Breadcrumbs(list(page)), page)
+        self.assertEqual(1, len(set([Breadcrumbs(list(page)), page])))
+        self.assertEqual(u'%s > Page' % section.render(), page.render())
+        
+    def test_render_per_language(self):
+        bs = Breadcrumbs([Breadcrumb(translation.ugettext_lazy('Yes'), '/')])
+        with translation.override('fr'):
+            fr = bs.render()
+        with translation.override('en'):
+            en = bs.render()
+        self.assertEqual(u'<a href="/">Yes</a>', en)
+        self.assertEqual(u'<a href="/">Oui</a>', fr)
+
+
+class BreadcrumbsTrieTest(TestCase):
+    urls = 'gafutils.tests.project.gafutils_testapp.urls'
+    
+    def setUp(self):
+        self.trie = BreadcrumbsTrie(titles={'blog:index': 'the blog'})
+    
+    def crumbs(self, path):
+        return [(b.name, b.url) for b in self.trie.get_breadcrumbs(path)]
+    
+    def test_static(self):
+        self.assertEqual([('home', '/')], self.crumbs('/'))
+        self.assertEqual([('home', '/'), ('about us', '/about/')], self.crumbs('/about/'))
+        self.assertEqual([('home', '/'), ('the blog', '/blog/'), ('archives', '/blog/archives/')],
+                         self.crumbs('/blog/archives/'))
+        self.assertTrue(self.trie.get_breadcrumbs('/blog/archives/').parent is self.trie.get_breadcrumbs('/blog/'))
+        
+    def test_wildcard(self):
+        self.assertEqual([('home', '/'), ('the blog', '/blog/'), ('post', '/blog/12/'), ('edit post', '/blog/12/edit')],
+                         self.crumbs('/blog/12/edit'))
+        
+    def test_wildcard_patterns(self):
+        self.assertEqual([('home', '/'), ('the blog', '/blog/'), ('category', '/blog/news/')],
+                         self.crumbs('/blog/news/'))
+        self.assertEqual([('home', '/'), ('the blog', '/blog/'), ('post', '/blog/12/')], self.crumbs('/blog/12/'))
+        # archives/feed/ only matches the category wildcard
+        self.assertEqual([('home', '/'), ('the blog', '/blog/'), ('category', '/blog/archives/'),
+                          ('category feed', '/blog/archives/feed/')], self.crumbs('/blog/archives/feed/'))
+        
+    def test_hostile_segment(self):
+        path = u'/tags/"><img src=x onerror=alert(1)>/'
+        self.assertEqual([('home', '/'), ('tag', '/tags/%22%3E%3Cimg%20src%3Dx%20onerror%3Dalert%281%29%3E/')],
+                         self.crumbs(path))
+        html = self.trie.get_breadcrumbs(path).render()
+        self.assertFalse('<img' in html, html)
+        html = Breadcrumb('<b>bold</b>', '/?a="b"').render()
+        self.assertEqual(u'<a href="/?a=&quot;b&quot;">&lt;b&gt;bold&lt;/b&gt;</a>', html)
+        
+    def test_unknown(self):
+        self.assertEqual([('home', '/'), ('about us', '/about/')], self.crumbs('/about/foo/'))
+        self.assertEqual([('home', '/'), ('the blog', '/blog/'), ('post', '/blog/12/')], self.crumbs('/blog/12/foo/'))
+        self.assertEqual([('home', '/')], self.crumbs('/nowhere/'))
+        
+    def test_context_processor_and_tag(self):
+        request = RequestFactory().get('/about/')
+        self.assertEqual(2, len(breadcrumbs(request)['url_breadcrumbs']))
+        html = Template('{% load gafutils_breadcrumbs %}{% url_breadcrumbs " / " %}').render(Context({'request': request}))
+        self.assertEqual(u'<a href="/">Home</a> / <a href="/about/">About us</a>', html)
+
+
+class CountingBreadcrumbs(Breadcrumbs):
+    renders = 0
+    
+    def render(self, sep=' > '):
+        CountingBreadcrumbs.renders += 1
+        return super(CountingBreadcrumbs, self).render(sep)
+
+
+class CachedBreadcrumbsTest(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        CountingBreadcrumbs.renders = 0
+        self.template = Template('{% load gafutils_breadcrumbs %}{% breadcrumbs %}')
+        
+    def render(self, trail):
+        return self.template.render(Context({'breadcrumbs': trail}))
+    
+    def test_cached(self):
+        trail = CountingBreadcrumbs([Breadcrumb('home', '/'), Breadcrumb('page')])
+        self.assertEqual(u'<a href="/">Home</a> > Page', self.render(trail))
+        renders = CountingBreadcrumbs.renders
+        self.assertEqual(u'<a href="/">Home</a> > Page', self.render(CountingBreadcrumbs(list(trail))))
+        self.assertEqual(renders, CountingBreadcrumbs.renders)
+        self.assertEqual(u'<a href="/">Home</a> > Other', self.render(trail.parent.grow(Breadcrumb('other'))))
+        self.assertTrue(CountingBreadcrumbs.renders > renders)
+        self.assertEqual(u'', self.render(None))
+        
+    def test_key(self):
+        trail = CountingBreadcrumbs([Breadcrumb('home', '/')])
+        self.assertEqual(u'<a href="/">Home</a>', render_cached(lambda: trail, key='/'))
+        self.assertEqual(1, CountingBreadcrumbs.renders)
+        # The function isn't called on cache hits
+        self.assertEqual(u'<a href="/">Home</a>', render_cached(None, key='/'))
+        self.assertEqual(1, CountingBreadcrumbs.renders)
+        self.assertEqual(trail.digest('en'), CountingBreadcrumbs([Breadcrumb('home', '/')]).digest('en'))
+        self.assertNotEqual(trail.digest('en'), trail.grow(Breadcrumb('page')).digest('en'))
+        
+    def test_invalidate(self):
+        trail = CountingBreadcrumbs([Breadcrumb('home', '/')])
+        self.render(trail)
+        invalidate_cache()
+        self.render(trail)
+        self.assertEqual(2, CountingBreadcrumbs.renders)
@@ -0,0 +1,18 @@
+from django.conf.urls.defaults import patterns, include, url
+
+blog_patterns = patterns('django.views.generic.simple',
+    url(r'^$', 'direct_to_template', name='index'),
+    url(r'^archives/$', 'direct_to_template', name='archives'),
+    url(r'^(?P<pk>\d+)/$', 'direct_to_template', name='post'),
+    url(r'^(?P<pk>\d+)/edit$', 'direct_to_template', name='edit_post'),
+    url(r'^(?P<slug>[a-z-]+)/$', 'direct_to_template', name='category'),
+    url(r'^(?P<slug>[a-z-]+)/feed/$', 'direct_to_template', name='category_feed'),
+)
+
+urlpatterns = patterns('django.views.generic.simple',
+    url(r'^$', 'direct_to_template', name='home'),
+    url(r'^about/$', 'direct_to_template', name='about_us'),
+    url(r'^tags/(?P<tag>[^/]+)/$', 'direct_to_template', name='tag'),
+    url(r'^blog/', include(blog_patterns, namespace='blog')),
+    url(r'^gafutils/', include('gafutils.urls')),
+)
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""Urls of the gafutils views, to be included by the project urlconf::
+
+    url(r'^gafutils/', include('gafutils.urls')),
+"""
+from django.conf.urls.defaults import patterns, url
+
+urlpatterns = patterns('gafutils.views.widgets',
+    url(r'^json/(?P<app_label>\w+)/(?P<model_name>\w+)/(?P<pk>[^/]+)/(?P<field_name>\w+)/$', 'json_value',
+        name='gafutils_json_value'),
+)
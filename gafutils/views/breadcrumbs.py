@@ -1,14 +1,32 @@
 # -*- coding: utf-8 -*-
-"""A simple breadcrumbs helper that I use to generate breadcrumbs from views."""
+"""A simple breadcrumbs helper that I use to generate breadcrumbs from views.
 
-from django.utils.encoding import StrAndUnicode, force_unicode
-from django.utils.translation import ugettext as _
+:class:`Breadcrumbs` are immutable linked lists : :meth:`Breadcrumbs.grow` returns
+a new trail that shares its parent, and each trail caches its rendered html (per language),
+so that rendering a trail only renders its last element once.
+
+:class:`BreadcrumbsTrie` builds trails automatically from the named patterns of an urlconf.
+"""
+
+import hashlib
+import re
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import get_resolver, get_script_prefix, RegexURLResolver
+from django.utils.encoding import force_unicode, smart_str
+from django.utils.html import conditional_escape, escape
+from django.utils.http import urlquote
+from django.utils.regex_helper import normalize
+from django.utils.translation import ugettext as _, get_language
 from django.utils.safestring import mark_safe
 from django.utils.text import capfirst
 
-class Breadcrumb(StrAndUnicode):
+class Breadcrumb(object):
     """A single breadcrumb element that knows how to display itself as html.
     """
+    __slots__ = ('name', 'url', '_html')
+
     def __init__(self, name, url=None):
         """
         :param str name: the display name
@@ -16,32 +34,387 @@ class Breadcrumb(StrAndUnicode):
         """
         self.name = name
         self.url = url
-        
+        self._html = {}
+
     def __unicode__(self):
         return force_unicode(self.render())
-    
+
+    def __str__(self):
+        return self.__unicode__().encode('utf-8')
+
     def render(self):
-        name = capfirst(force_unicode(self.name))
+        """Returns the html, cached per language as the name may be a lazy translation"""
+        language = get_language()
+        try:
+            return self._html[language]
+        except KeyError:
+            pass
+        name = conditional_escape(capfirst(force_unicode(self.name)))
         if self.url is None:
-            return name
+            html = name
         else:
-            return '<a href="%s">%s</a>' % (self.url, name)
-        
-class Breadcrumbs(StrAndUnicode, list):
-    """A list of :class:`Breadcrumb` elements that knows how to display itself as html."""
-    
+            html = u'<a href="%s">%s</a>' % (escape(self.url), name)
+        self._html[language] = html
+        return html
+
+class Breadcrumbs(object):
+    """An immutable sequence of :class:`Breadcrumb` elements that knows how to display itself as html.
+
+    Each instance holds its last element and a reference to its parent trail.
+    """
+    __slots__ = ('parent', 'crumb', '_len', '_html', '_digests')
+
+    def __init__(self, crumbs=(), parent=None):
+        """
+        :param crumbs: the :class:`Breadcrumb` elements
+        :param parent: a :class:`Breadcrumbs` instance to prepend to `crumbs`
+        """
+        crumbs = list(crumbs)
+        if crumbs:
+            for crumb in crumbs[:-1]:
+                parent = self._make(parent, crumb)
+            self._set(parent, crumbs[-1])
+        elif parent is not None:
+            self._set(parent.parent, parent.crumb)
+        else:
+            self._set(None, None)
+
+    @classmethod
+    def _make(cls, parent, crumb):
+        node = cls.__new__(cls)
+        node._set(parent, crumb)
+        return node
+
+    def _set(self, parent, crumb):
+        if parent is not None and parent.crumb is None:
+            parent = None
+        self.parent = parent
+        self.crumb = crumb
+        self._len = 0 if crumb is None else (parent._len if parent is not None else 0) + 1
+        self._html = {}
+        self._digests = {}
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        crumbs = []
+        node = self
+        while node is not None and node.crumb is not None:
+            crumbs.append(node.crumb)
+            node = node.parent
+        return reversed(crumbs)
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+    def __eq__(self, other):
+        return isinstance(other, Breadcrumbs) and tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self))
+
     def __unicode__(self):
         return force_unicode(self.render())
-    
+
+    def __str__(self):
+        return self.__unicode__().encode('utf-8')
+
     def grow(self, *elements):
         """Returns a new :class:`Breadcrumbs` instance, appending to itself the given :class:`Breadcrumb` elements."""
-        bs = Breadcrumbs(self)
-        bs.extend(elements)
-        return bs
-        
+        node = self if self.crumb is not None else None
+        for element in elements:
+            node = self._make(node, element)
+        return node if node is not None else self
+
+    def digest(self, language):
+        """Returns a digest of the crumbs' names (in `language`) and urls, memoised like the html."""
+        try:
+            return self._digests[language]
+        except KeyError:
+            pass
+        if self.crumb is None:
+            digest = ''
+        else:
+            digest = hashlib.md5('%s\0%s\0%s' % (
+                self.parent.digest(language) if self.parent is not None else '',
+                smart_str(self.crumb.name), smart_str(self.crumb.url or ''))).hexdigest()
+        self._digests[language] = digest
+        return digest
+
     def render(self, sep=' > '):
-        return mark_safe(sep.join(force_unicode(b) for b in self))
+        key = (get_language(), sep)
+        try:
+            return self._html[key]
+        except KeyError:
+            pass
+        if self.crumb is None:
+            html = u''
+        elif self.parent is None:
+            html = force_unicode(self.crumb)
+        else:
+            html = self.parent.render(sep) + force_unicode(sep) + force_unicode(self.crumb)
+        html = self._html[key] = mark_safe(html)
+        return html
 
 home_breadcrumbs = Breadcrumbs([
     Breadcrumb(_('Home'), '/'),
 ])
+
+class _TrieNode(object):
+    __slots__ = ('children', 'wildcards', 'regex', 'name', 'title', 'slash', 'trail')
+
+    def __init__(self, regex=None):
+        self.children = {}
+        self.wildcards = []
+        self.regex = regex
+        self.name = None
+        self.title = None
+        self.slash = True
+        self.trail = None
+
+_named_group_re = re.compile(r'\(\?P<(\w+)>')
+_placeholder_re = re.compile(r'%\((\w+)\)s')
+
+def _group_patterns(regex):
+    """Returns a dict mapping the named groups of `regex` to their patterns."""
+    patterns = {}
+    for match in _named_group_re.finditer(regex):
+        depth, i = 1, match.end()
+        while i < len(regex) and depth:
+            if regex[i] == '\\':
+                i += 1
+            elif regex[i] == '(':
+                depth += 1
+            elif regex[i] == ')':
+                depth -= 1
+            i += 1
+        patterns[match.group(1)] = regex[match.end():i - 1]
+    return patterns
+
+def _segment_regex(segment, groups):
+    """Returns the regex of a normalized path `segment`, its placeholders being replaced by their group pattern."""
+    parts, pos = [], 0
+    for match in _placeholder_re.finditer(segment):
+        parts.append(re.escape(segment[pos:match.start()].replace('%%', '%')))
+        parts.append('(?:%s)' % groups.get(match.group(1), '[^/]+'))
+        pos = match.end()
+    parts.append(re.escape(segment[pos:].replace('%%', '%')))
+    return '^%s$' % ''.join(parts)
+
+class BreadcrumbsTrie(object):
+    """A trie of url path segments built once from the named patterns of an urlconf.
+
+    Each segment of a pattern is either static (``blog``) or a wildcard (``(?P<pk>\d+)``),
+    wildcards with different patterns being different nodes.
+    Getting the trail of a path walks the trie segment by segment, trying the static segment
+    first, then the wildcards in urlconf order, and backtracking when the rest of the path doesn't
+    match. Only wildcards are matched with a regex.
+    Trails of static paths are built with the trie and shared between requests.
+
+    Unlike :func:`~django.core.urlresolvers.resolve`, a static segment wins over a wildcard
+    of a previous pattern, and groups matching several segments (``(?P<path>.+)``) only match one.
+
+    :param urlconf: the urlconf module name, defaults to ``settings.ROOT_URLCONF``
+    :param dict titles: maps url names (``'namespace:name'`` for namespaced urls) to titles,
+                        the default title being the url name
+    :param str prefix: the script prefix to build urls with, defaults to the current one
+    """
+
+    def __init__(self, urlconf=None, titles=None, prefix=None):
+        self.titles = titles or {}
+        self.prefix = prefix if prefix is not None else get_script_prefix()
+        self.root = _TrieNode()
+        self._add_patterns(get_resolver(urlconf).url_patterns, u'', u'')
+        self._build_trails(self.root, Breadcrumbs(), [])
+
+    def _add_patterns(self, patterns, prefix, namespace):
+        for pattern in patterns:
+            regex = prefix + pattern.regex.pattern.lstrip('^')
+            if isinstance(pattern, RegexURLResolver):
+                if pattern.namespace:
+                    self._add_patterns(pattern.url_patterns, regex, namespace + pattern.namespace + ':')
+                else:
+                    self._add_patterns(pattern.url_patterns, regex, namespace)
+            elif pattern.name:
+                self._add(regex, namespace + pattern.name)
+
+    def _add(self, regex, name):
+        try:
+            possibilities = normalize(regex)
+        except (ValueError, NotImplementedError):
+            return
+        groups = _group_patterns(regex)
+        for path, params in possibilities:
+            node = self.root
+            for segment in path.split('/'):
+                if not segment:
+                    continue
+                if '%(' in segment:
+                    pattern = _segment_regex(segment, groups)
+                    for wildcard in node.wildcards:
+                        if wildcard.regex.pattern == pattern:
+                            node = wildcard
+                            break
+                    else:
+                        wildcard = _TrieNode(re.compile(pattern, re.UNICODE))
+                        node.wildcards.append(wildcard)
+                        node = wildcard
+                else:
+                    node = node.children.setdefault(segment.replace('%%', '%'), _TrieNode())
+            # the first pattern wins, as with resolve()
+            if node.name is None:
+                node.name = name
+                node.title = self.get_title(name)
+                node.slash = not path or path.endswith('/')
+
+    def get_title(self, name):
+        """Returns the title of the url named `name`."""
+        try:
+            return self.titles[name]
+        except KeyError:
+            return name.rsplit(':', 1)[-1].replace('_', ' ').replace('-', ' ')
+
+    def _url(self, node, segments):
+        # Segments come from the decoded request path
+        url = self.prefix + u'/'.join(urlquote(segment) for segment in segments)
+        if segments and node.slash:
+            url += u'/'
+        return url
+
+    def _build_trails(self, node, trail, segments):
+        if node.title is not None:
+            trail = trail.grow(Breadcrumb(node.title, self._url(node, segments)))
+        node.trail = trail
+        for segment, child in node.children.iteritems():
+            self._build_trails(child, trail, segments + [segment])
+
+    def _match(self, node, segments, index):
+        """Returns the nodes matching `segments` from `index`, the last one being named, or None."""
+        if index == len(segments):
+            return [] if node.name is not None else None
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            nodes = self._match(child, segments, index + 1)
+            if nodes is not None:
+                return [child] + nodes
+        for wildcard in node.wildcards:
+            if wildcard.regex.match(segment):
+                nodes = self._match(wildcard, segments, index + 1)
+                if nodes is not None:
+                    return [wildcard] + nodes
+        return None
+
+    def _match_ancestors(self, segments):
+        nodes = []
+        node = self.root
+        for segment in segments:
+            child = node.children.get(segment)
+            if child is None:
+                for wildcard in node.wildcards:
+                    if wildcard.regex.match(segment):
+                        child = wildcard
+                        break
+                else:
+                    break
+            nodes.append(child)
+            node = child
+        return nodes
+
+    def get_breadcrumbs(self, path):
+        """Returns the :class:`Breadcrumbs` of `path` (without the script prefix).
+
+        Unknown paths get the trail of their known ancestors : walking stops at the first unknown segment.
+        """
+        segments = [segment for segment in path.split('/') if segment]
+        nodes = self._match(self.root, segments, 0)
+        if nodes is None:
+            nodes = self._match_ancestors(segments)
+        trail = self.root.trail
+        for index, node in enumerate(nodes):
+            if node.trail is not None:
+                trail = node.trail
+            elif node.title is not None:
+                trail = trail.grow(Breadcrumb(node.title, self._url(node, segments[:index + 1])))
+        return trail
+
+_tries = {}
+
+def get_breadcrumbs_trie(urlconf=None):
+    """Returns the :class:`BreadcrumbsTrie` of `urlconf`, built on first call.
+
+    Titles are taken from the ``BREADCRUMBS_TITLES`` setting.
+    """
+    key = (urlconf or settings.ROOT_URLCONF, get_script_prefix())
+    try:
+        return _tries[key]
+    except KeyError:
+        trie = _tries[key] = BreadcrumbsTrie(urlconf, getattr(settings, 'BREADCRUMBS_TITLES', None))
+        return trie
+
+def get_request_breadcrumbs(request):
+    """Returns the :class:`Breadcrumbs` of `request`, built from its urlconf."""
+    urlconf = getattr(request, 'urlconf', None)
+    return get_breadcrumbs_trie(urlconf).get_breadcrumbs(request.path_info)
+
+CACHE_VERSION_KEY = 'gafutils.breadcrumbs.version'
+
+def get_cache_version():
+    """Returns the version of cached breadcrumbs.
+
+    A missing version is initialised from the clock so that it never goes back to an older one.
+    """
+    version = cache.get(CACHE_VERSION_KEY)
+    if version is None:
+        version = int(time.time())
+        if not cache.add(CACHE_VERSION_KEY, version):
+            version = cache.get(CACHE_VERSION_KEY, version)
+    return version
+
+def invalidate_cache():
+    """Invalidates all cached breadcrumbs."""
+    try:
+        cache.incr(CACHE_VERSION_KEY)
+    except ValueError:
+        cache.set(CACHE_VERSION_KEY, int(time.time()))
+
+def get_cache_key(breadcrumbs, sep=' > ', key=None):
+    """Returns the cache key of `breadcrumbs` in the active language.
+
+    :param key: a key identifying the trail (e.g. the request path), defaults to the digest of the crumbs'
+                names and urls (see :meth:`Breadcrumbs.digest`)
+    """
+    language = get_language()
+    if key is None:
+        key = breadcrumbs.digest(language)
+    return 'gafutils.breadcrumbs.%s.%s' % (language, hashlib.md5('%s\0%s' % (smart_str(key), smart_str(sep))).hexdigest())
+
+def render_cached(breadcrumbs, sep=' > ', timeout=None, key=None):
+    """Renders `breadcrumbs` through the cache.
+
+    Fragments are stored with the cache version they were rendered at, so that the version
+    and the fragment are fetched in a single round trip.
+
+    With a `key`, `breadcrumbs` may be a callable returning the trail, only called on cache misses.
+
+    :param timeout: the cache timeout, defaults to the ``BREADCRUMBS_CACHE_TIMEOUT`` setting or the cache's
+    :param key: see :func:`get_cache_key`
+    """
+    cache_key = get_cache_key(breadcrumbs, sep, key)
+    cached = cache.get_many([CACHE_VERSION_KEY, cache_key])
+    version = cached.get(CACHE_VERSION_KEY)
+    if version is None:
+        version = get_cache_version()
+    html_version, html = cached.get(cache_key, (None, None))
+    if html_version != version:
+        if callable(breadcrumbs):
+            breadcrumbs = breadcrumbs()
+        html = breadcrumbs.render(sep)
+        if timeout is None:
+            timeout = getattr(settings, 'BREADCRUMBS_CACHE_TIMEOUT', None)
+        cache.set(cache_key, (version, html), timeout)
+    return mark_safe(html)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Views used by :mod:`gafutils.forms.widgets`."""
+
+from django.contrib.auth.decorators import user_passes_test
+from django.core.exceptions import PermissionDenied
+from django.db.models import get_model
+from django.db.models.fields import FieldDoesNotExist
+from django.http import HttpResponse, Http404
+from django.shortcuts import get_object_or_404
+from gafutils.forms.widgets import get_json_encoder_class
+
+@user_passes_test(lambda user: user.is_active and user.is_staff)
+def json_value(request, app_label, model_name, pk, field_name):
+    """Returns the full value behind a truncated :class:`~gafutils.forms.widgets.JsonTextAreaWidget`,
+    read from the `field_name` field of the object. The user needs the change permission of the model.
+
+    The json is encoded incrementally, with the ``indent`` GET parameter or compact.
+    """
+    model = get_model(app_label, model_name)
+    if model is None:
+        raise Http404
+    opts = model._meta
+    if not request.user.has_perm('%s.%s' % (opts.app_label, opts.get_change_permission())):
+        raise PermissionDenied
+    try:
+        opts.get_field(field_name)
+    except FieldDoesNotExist:
+        raise Http404
+    value = getattr(get_object_or_404(model._default_manager, pk=pk), field_name)
+    if isinstance(value, basestring):
+        return HttpResponse(value, mimetype='application/json')
+    try:
+        indent = int(request.GET['indent'])
+    except (KeyError, ValueError):
+        encoder = get_json_encoder_class()(separators=(',', ':'))
+    else:
+        encoder = get_json_encoder_class()(indent=indent)
+    return HttpResponse(encoder.iterencode(value), mimetype='application/json')